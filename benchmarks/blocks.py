@@ -0,0 +1,89 @@
+"""
+Synthetic tmpo blocks, laid out over a sensor history like the Flukso API
+serves them: the largest complete, aligned block of lvl 20, 16, 12 or 8 at
+each point in time, ending with a (partial) lvl 8 block. A history that
+starts inside a block starts with the aligned block holding its head, which
+only has data from the head on.
+"""
+
+import gzip
+import json
+import random
+
+LVLS = (20, 16, 12, 8)
+
+
+def layout(head, tail):
+    """
+    Parameters
+    ----------
+    head : int
+        first epoch of the history
+    tail : int
+        last epoch of the history
+
+    Returns
+    -------
+    list[(int, int)]
+        (lvl, bid) of the blocks covering [head, tail], in time order
+    """
+    blocks = []
+    bid = head
+    while bid <= tail:
+        for lvl in LVLS:
+            start = bid >> lvl << lvl
+            if start + (1 << lvl) <= tail + 1 or lvl == 8:
+                blocks.append((lvl, start))
+                bid = start + (1 << lvl)
+                break
+    return blocks
+
+
+def make_block(lvl, bid, step=1, start=3054225, seed=None, head=None,
+               tail=None):
+    """
+    Gzip encoded tmpo block of a counter sampled about every step seconds
+
+    Parameters
+    ----------
+    lvl : int
+    bid : int
+    step : int
+        mean sampling interval in seconds
+    start : int
+        counter value at the start of the block
+    seed : int, optional
+        seed for the sampling jitter and counter increments, no jitter and
+        a fixed increment pattern when None
+    head : int, optional
+        first epoch to include, default the start of the block
+    tail : int, optional
+        last epoch to include, default the end of the block
+
+    Returns
+    -------
+    bytes
+    """
+    end = bid + (1 << lvl) if tail is None else min(tail + 1, bid + (1 << lvl))
+    rnd = random.Random(seed)
+    t, v = [], []
+    first = bid if head is None else max(bid, head)
+    now, prev = first, first
+    i = 0
+    while now < end:
+        t.append(now - prev)
+        if i == 0:
+            v.append(0)
+        else:
+            v.append(i % 3 if seed is None else rnd.randint(0, 5))
+        prev = now
+        now += step if seed is None else max(1, step + rnd.randint(-1, 1))
+        i += 1
+    if t:
+        t[0] = 0
+    head = [first, start]
+    tail = [first + sum(t), start + sum(v)]
+    data = {"h": {"cfg": {"id": "0" * 32}, "head": head, "tail": tail},
+            "t": t, "v": v}
+    jblk = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return gzip.compress(jblk)
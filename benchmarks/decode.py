@@ -0,0 +1,77 @@
+"""
+Benchmark the tmpo block decoder against the legacy regex + nditer path,
+and the bin codec against gzip json.
+
+    $ python benchmarks/decode.py [--seed N] [lvl ...]
+
+Blocks hold a regular counter by default, or jittered samples and random
+increments with --seed.
+"""
+
+import json
+import re
+import sys
+import timeit
+import os
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tmpo
+from blocks import make_block
+
+RE_JSON_BLK = r'^\{"h":(?P<h>\{.+?\}),"t":(?P<t>\[.+?\]),"v":(?P<v>\[.+?\])\}$'
+
+
+def blk2series(ext, blk, head, tail):
+    t, v = tmpo._truncate(*tmpo._blk2arrays(ext, blk), head=head, tail=tail)
+    return pd.Series(v, index=t)
+
+
+def legacy_blk2series(ext, blk, head, tail):
+    """The pre-vectorized decoder: regex, json parse and a python loop"""
+    jblk = tmpo._decompress_block(blk, ext)
+    m = re.match(RE_JSON_BLK, jblk.decode("utf-8"))
+    t = np.array(json.loads(m.group("t")), dtype=np.int64)
+    v = np.array(json.loads(m.group("v")), dtype=np.float64)
+    h = json.loads(m.group("h"))
+    for a, delta in ((t, h["head"][0]), (v, h["head"][1])):
+        for x in np.nditer(a, op_flags=["readwrite"]):
+            delta += x
+            x[...] = delta
+    return pd.Series(v, index=t).loc[head:tail]
+
+
+def main(lvls, seed=None):
+    for lvl in lvls:
+        bid = 1400000000 >> lvl << lvl
+        blk = make_block(lvl, bid, seed=seed)
+        head, tail = bid, tmpo.EPOCHS_MAX
+        old = legacy_blk2series("gz", blk, head, tail)
+        new = blk2series("gz", blk, head, tail)
+        assert (old.index == new.index).all() and (old == new).all()
+        bin_blk = tmpo._gz2bin(blk)[0]
+        assert blk2series(tmpo.BIN_EXT, bin_blk, head, tail).equals(new)
+        n = max(1, 2 ** (20 - lvl))
+        t_old = timeit.timeit(
+            lambda: legacy_blk2series("gz", blk, head, tail),
+            number=n) / n
+        t_new = timeit.timeit(
+            lambda: blk2series("gz", blk, head, tail), number=n) / n
+        t_gz = timeit.timeit(
+            lambda: tmpo._blk2arrays("gz", blk), number=n) / n
+        t_bin = timeit.timeit(
+            lambda: tmpo._blk2arrays(tmpo.BIN_EXT, bin_blk), number=n) / n
+        print("lvl:%2d samples:%7d legacy[ms]:%9.3f new[ms]:%8.3f "
+              "speedup:%6.1fx gz[ms]:%8.3f bin[ms]:%8.3f bin speedup:%6.1fx"
+              % (lvl, len(new), t_old * 1e3, t_new * 1e3, t_old / t_new,
+                 t_gz * 1e3, t_bin * 1e3, t_gz / t_bin))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    seed = None
+    if args[:1] == ["--seed"]:
+        seed, args = int(args[1]), args[2:]
+    main([int(a) for a in args] or [8, 12, 16], seed)
@@ -0,0 +1,63 @@
+"""
+Benchmark parallel block decoding in Session.dataframe(). Blocks are
+stored as gzip json, as served by the API, unless another codec is given.
+
+    $ python benchmarks/parallel.py [sensors] [blocks] [gz|bin]
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tmpo
+from blocks import make_block
+
+
+def populate(path, sensors, blocks, codec, lvl=16, step=8):
+    s = tmpo.Session(path, codec=codec)
+    bid = 1400000000 >> lvl << lvl
+    rows = []
+    for i in range(sensors):
+        sid = "%032x" % i
+        s.add(sid, "0" * 32)
+        for k in range(blocks):
+            b = bid + k * 2 ** lvl
+            blk = make_block(lvl, b, step)
+            rows.append(s._block_row(blk, sid, 0, lvl, b, "gz"))
+    with s.transaction():
+        s._store(rows)
+    s.close()
+    return ["%032x" % i for i in range(sensors)]
+
+
+def main(sensors=64, blocks=8, codec="gz"):
+    path = tempfile.mkdtemp()
+    try:
+        sids = populate(path, sensors, blocks, codec)
+        cpus = multiprocessing.cpu_count()
+        counts = sorted(set([1, 2, 4, 8, 16, cpus]))
+        configs = [(None, 1)] + [(decoder, n)
+                                 for decoder in ("thread", "process")
+                                 for n in counts if n <= cpus]
+        base = None
+        for decoder, n in configs:
+            s = tmpo.Session(path, cache_size=0, decoder=decoder,
+                             decoder_workers=n)
+            s.dataframe(sids[:2])  # spin up the pool
+            t = min(timeit.repeat(
+                lambda: s.dataframe(sids, datetime=False), number=1, repeat=3))
+            base = base or t
+            print("codec:%s decoder:%-7s workers:%2d time[s]:%7.3f "
+                  "speedup:%5.2fx" % (codec, decoder, n, t, base / t))
+            s.close()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(*[int(a) for a in args[:2]] + args[2:3])
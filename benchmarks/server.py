@@ -0,0 +1,133 @@
+"""
+Local stand-in for the Flukso tmpo API, serving synthetic blocks over plain
+HTTP.
+
+    >>> srv = FakeApi(step=8).serve()
+    >>> srv.add("fed676021dacaaf6a12a8dda7685be34", head, tail)
+    >>> srv.use(session)
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import threading
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tmpo
+from blocks import layout, make_block
+
+RE_SYNC = re.compile(r"^/sensor/(?P<sid>[0-9a-f]+)/tmpo/sync$")
+RE_BLOCK = re.compile(
+    r"^/sensor/(?P<sid>[0-9a-f]+)/tmpo/"
+    r"(?P<rid>\d+)/(?P<lvl>\d+)/(?P<bid>\d+)$")
+
+
+class FakeApi():
+    def __init__(self, step=1, errors=0.0):
+        """
+        Parameters
+        ----------
+        step : int
+            mean sampling interval of the generated blocks in seconds
+        errors : float
+            fraction of requests answered with a transient 503 error
+        """
+        self.step = step
+        self.errors = errors
+        self.fail = set()  # (sid, lvl, bid) of blocks answered with a 503
+        self.sensors = {}
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._srv = None
+
+    def add(self, sid, head, tail):
+        """Serve a sensor with data in [head, tail]. Its blocks are generated
+        up front, so serving them measures the client and not the server."""
+        blocks = {}
+        for lvl, bid in layout(head, tail):
+            seed = zlib.crc32(("%s/%d/%d" % (sid, lvl, bid)).encode("ascii"))
+            blocks[(lvl, bid)] = make_block(
+                lvl, bid, self.step, seed=seed, head=head, tail=tail)
+        self.sensors[sid] = blocks
+
+    def listing(self, sid, rid, lvl, bid):
+        last = bid + (1 << lvl) if lvl else 0
+        return [{"rid": 0, "lvl": l, "bid": b, "ext": "gz"}
+                for l, b in sorted(self.sensors[sid],
+                                   key=lambda block: block[1])
+                if b + (1 << l) > last]
+
+    def block(self, sid, rid, lvl, bid):
+        return self.sensors[sid][(lvl, bid)]
+
+    def serve(self, host="127.0.0.1", port=0):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if random.random() < api.errors:
+                    return self.send_error(503)
+                url = urlparse(self.path)
+                m = RE_SYNC.match(url.path)
+                if m and m.group("sid") in api.sensors:
+                    q = dict((k, int(v[0]))
+                             for k, v in parse_qs(url.query).items())
+                    body = json.dumps(api.listing(
+                        m.group("sid"), q.get("rid", 0), q.get("lvl", 0),
+                        q.get("bid", 0))).encode("utf-8")
+                    return self.reply(body, "application/json")
+                m = RE_BLOCK.match(url.path)
+                if m and (m.group("sid"), int(m.group("lvl")),
+                          int(m.group("bid"))) in api.fail:
+                    return self.send_error(503)
+                if m and m.group("sid") in api.sensors:
+                    body = api.block(m.group("sid"), int(m.group("rid")),
+                                     int(m.group("lvl")), int(m.group("bid")))
+                    return self.reply(body, "application/gzip")
+                self.send_error(404)
+
+            def reply(self, body, ctype):
+                with api._lock:
+                    api.requests += 1
+                    api.bytes += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 1024
+
+        self._srv = Server((host, port), Handler)
+        t = threading.Thread(target=self._srv.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    @property
+    def address(self):
+        return "%s:%d" % self._srv.server_address[:2]
+
+    def use(self, session):
+        """Point a Session at this server instead of api.flukso.net"""
+        for module in (tmpo, sys.modules.get("tmpo.aio")):
+            if module is not None:
+                module.API_TMPO_SYNC = "http://%s/sensor/%s/tmpo/sync"
+                module.API_TMPO_BLOCK = "http://%s/sensor/%s/tmpo/%d/%d/%d"
+        session.host = self.address
+
+    def shutdown(self):
+        self._srv.shutdown()
+        self._srv.server_close()
@@ -0,0 +1,134 @@
+"""
+Offline benchmark suite for tmpo: syncs synthetic sensors from a local
+stand-in of the Flukso API and times the query commands, at several history
+lengths. Results are written as JSON so runs can be compared across
+releases.
+
+    $ python benchmarks/suite.py --days 1 7 30 --sensors 4 --step 8 \\
+          --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tmpo
+from server import FakeApi
+
+TAIL = 1500000000
+
+
+def timed(func, repeat):
+    """Best and median wall time of func in seconds"""
+    times = timeit.repeat(func, number=1, repeat=repeat)
+    return {"min": min(times), "median": float(np.median(times))}
+
+
+def dbsize(session):
+    return sum(os.path.getsize(session.db + ext)
+               for ext in ("", "-wal") if os.path.exists(session.db + ext))
+
+
+def run(days, sensors, step, repeat, workers, errors=0.0):
+    path = tempfile.mkdtemp()
+    api = FakeApi(step=step, errors=errors).serve()
+    try:
+        head = TAIL - days * 86400
+        sids = ["%032x" % i for i in range(sensors)]
+        for sid in sids:
+            api.add(sid, head, TAIL)
+        s = tmpo.Session(path, workers=workers)
+        api.use(s)
+        for sid in sids:
+            s.add(sid, "0" * 32)
+
+        t0 = time.time()
+        synced = s.sync()
+        dt = time.time() - t0
+        blocks = sum(n for n in synced.values() if isinstance(n, int))
+        result = {
+            "days": days,
+            "sensors": sensors,
+            "step": step,
+            "error_rate": errors,
+            "samples": len(s.series(sids[0], datetime=False)) * sensors,
+            "sync": {
+                "time": dt,
+                "blocks": blocks,
+                "bytes": api.bytes,
+                "blocks_per_s": blocks / dt,
+                "bytes_per_s": api.bytes / dt,
+                "errors": sensors - sum(
+                    isinstance(n, int) for n in synced.values())},
+            "db_bytes": dbsize(s)}
+
+        cold = tmpo.Session(path, cache_size=0)
+        api.use(cold)
+        sid = sids[0]
+        result["query"] = {
+            "series_1h": timed(lambda: cold.series(
+                sid, head=TAIL - 3600, datetime=False), repeat),
+            "series_1d": timed(lambda: cold.series(
+                sid, head=TAIL - 86400, datetime=False), repeat),
+            "series_all": timed(lambda: cold.series(
+                sid, datetime=False), repeat),
+            "series_all_cached": timed(lambda: s.series(
+                sid, datetime=False), repeat),
+            "dataframe_all": timed(lambda: cold.dataframe(
+                sids, datetime=False), repeat),
+            "aggregate_1h_mean": timed(lambda: cold.aggregate(
+                sid, freq="1h", datetime=False), repeat),
+            "last_datapoint": timed(lambda: cold.last_datapoint(
+                sid, epoch=True), repeat)}
+        s.close()
+        cold.close()
+        return result
+    finally:
+        api.shutdown()
+        shutil.rmtree(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 30],
+                        help="history lengths to benchmark")
+    parser.add_argument("--sensors", type=int, default=4)
+    parser.add_argument("--step", type=int, default=8,
+                        help="sampling interval in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--errors", type=float, default=0.0,
+                        help="fraction of API requests failing with a 503")
+    parser.add_argument("--output", help="JSON file, default stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        "tmpo": tmpo.__version__,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "runs": [run(days, args.sensors, args.step, args.repeat, args.workers,
+                     args.errors)
+                 for days in args.days]}
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
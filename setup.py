@@ -54,15 +54,12 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
     ],
 
+    python_requires='>=3.7',
+
     keywords='data monitoring tmpo timeseries sqlite',
 
     # You can just specify the packages manually here if your project is
@@ -75,7 +72,18 @@ setup(
 
     # List run-time dependencies here.  These will be installed by pip when
     # your project is installed. 
-    install_requires=['numpy', 'pandas', 'futures', 'requests_futures'],
+    install_requires=['numpy', 'pandas', 'requests_futures'],
+
+    # Optional dependencies, installed with e.g. pip install tmpo[async]
+    extras_require={
+        'async': ['aiohttp'],
+        'columnar': ['pyarrow'],
+    },
+
+    # Command line scripts, tmpo runs a sync daemon among other commands
+    entry_points={
+        'console_scripts': ['tmpo=tmpo.daemon:main'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
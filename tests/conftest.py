@@ -0,0 +1,58 @@
+import gzip
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir,
+                                "benchmarks"))
+
+import tmpo
+from server import FakeApi
+
+NOW = 1500000000
+
+
+def jblock(bid, t, v, head_v=0):
+    """Gzip json tmpo block with timestamp and value deltas t and v"""
+    head = [bid, head_v]
+    data = {"h": {"cfg": {"id": "0" * 32}, "head": head,
+                  "tail": [bid + sum(t), head_v + sum(v)]},
+            "t": t, "v": v}
+    return gzip.compress(json.dumps(data, separators=(",", ":")).encode())
+
+
+def reference(api, sid):
+    """Samples of the blocks served for a sensor, decoded in plain python"""
+    t, v = [], []
+    for lvl, bid in sorted(api.sensors[sid], key=lambda block: block[1]):
+        data = json.loads(gzip.decompress(api.sensors[sid][(lvl, bid)]))
+        ht, hv = data["h"]["head"]
+        for dt, dv in zip(data["t"], data["v"]):
+            ht += dt
+            hv += dv
+            t.append(ht)
+            v.append(hv)
+    return np.array(t, dtype=np.int64), np.array(v, dtype=np.float64)
+
+
+@pytest.fixture
+def api():
+    api = FakeApi(step=60).serve()
+    yield api
+    api.shutdown()
+
+
+@pytest.fixture
+def session(tmp_path, api):
+    def make(**kwargs):
+        s = tmpo.Session(str(tmp_path), **kwargs)
+        api.use(s)
+        sessions.append(s)
+        return s
+    sessions = []
+    yield make
+    for s in sessions:
+        s.close()
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+import tmpo
+from conftest import NOW, jblock
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)
+SIDS = ["%032x" % i for i in range(2)]
+
+
+def block(n):
+    """Arrays of n samples, 16 * n bytes"""
+    return np.arange(n, dtype=np.int64), np.zeros(n)
+
+
+def test_lru():
+    cache = tmpo.BlockCache(16 * 30)
+    for i in range(3):
+        cache.put((SIDS[0], 0, 8, i, 1.0), block(10))
+    assert cache.get((SIDS[0], 0, 8, 0, 1.0)) is not None
+    # the least recently used block goes first
+    cache.put((SIDS[1], 0, 8, 0, 1.0), block(10))
+    assert cache.get((SIDS[0], 0, 8, 1, 1.0)) is None
+    assert cache.get((SIDS[0], 0, 8, 0, 1.0)) is not None
+    assert cache.stats() == {
+        "hits": 2, "misses": 1, "evictions": 1, "blocks": 3,
+        "nbytes": 16 * 30, "size": 16 * 30}
+    # blocks over budget are not cached, and evict nothing
+    cache.put((SIDS[1], 0, 8, 1, 1.0), block(31))
+    assert cache.stats()["blocks"] == 3
+    # replacing a block accounts for its new size
+    cache.put((SIDS[0], 0, 8, 0, 1.0), block(5))
+    assert cache.nbytes == 16 * 25
+    cache.put((SIDS[1], 0, 8, 2, 1.0), block(20))
+    assert cache.nbytes == 16 * 25 and cache.evictions == 3
+    assert cache.get((SIDS[0], 0, 8, 0, 1.0)) is not None
+
+
+def test_invalidate():
+    cache = tmpo.BlockCache()
+    for sid in SIDS:
+        for i in range(3):
+            cache.put((sid, 0, 8, i, 1.0), block(10))
+    cache.invalidate(SIDS[0])
+    assert cache.stats()["blocks"] == 3 and cache.nbytes == 16 * 30
+    assert cache.get((SIDS[0], 0, 8, 0, 1.0)) is None
+    assert cache.get((SIDS[1], 0, 8, 0, 1.0)) is not None
+    cache.invalidate("%032x" % 9)
+    cache.clear()
+    assert cache.stats()["blocks"] == 0 and cache.nbytes == 0
+
+
+def test_disabled():
+    cache = tmpo.BlockCache(0)
+    cache.put((SIDS[0], 0, 8, 0, 1.0), block(1))
+    assert cache.get((SIDS[0], 0, 8, 0, 1.0)) is None
+
+
+@pytest.fixture
+def synced(api, session):
+    for sid in SIDS:
+        api.add(sid, HEAD, NOW)
+    s = session()
+    for sid in SIDS:
+        s.add(sid, "t")
+    s.sync()
+    for sid in SIDS:
+        s.series(sid)
+    return s
+
+
+def blocks(api, sid):
+    return len(api.sensors[sid])
+
+
+def test_hits(api, synced):
+    stats = synced.cache.stats()
+    assert stats["blocks"] == blocks(api, SIDS[0]) + blocks(api, SIDS[1])
+    assert stats["misses"] == stats["blocks"]
+    synced.series(SIDS[0])
+    assert synced.cache.stats()["hits"] == stats["hits"] + blocks(
+        api, SIDS[0])
+    assert synced.cache.stats()["misses"] == stats["misses"]
+
+
+def test_store(api, synced):
+    """Writing a block drops the cached blocks of its sensor only"""
+    bid = (NOW >> 8 << 8) + 256
+    content = jblock(bid, [0, 60], [1, 1])
+    with synced.transaction():
+        rows, arrays, e = synced._block_rows(
+            SIDS[0], [{"rid": 0, "lvl": 8, "bid": bid, "ext": "gz"}],
+            [content])
+        synced._store(rows, arrays)
+    assert synced.cache.stats()["blocks"] == blocks(api, SIDS[1])
+    assert synced.series(SIDS[0], datetime=False).index[-1] == bid + 60
+
+
+def test_clean(api, synced):
+    with synced.transaction():
+        synced._clean((SIDS[0], 0, 20, HEAD))
+    assert synced.cache.stats()["blocks"] == blocks(api, SIDS[1])
+
+
+def test_reset(api, synced):
+    synced.reset(SIDS[0])
+    assert synced.cache.stats()["blocks"] == blocks(api, SIDS[1])
+    assert len(synced.series(SIDS[0])) == 0
+    synced.remove(SIDS[1])
+    assert synced.cache.stats()["blocks"] == 0
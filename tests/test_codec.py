@@ -0,0 +1,80 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import tmpo
+from conftest import NOW, jblock
+
+BID = NOW >> 8 << 8
+
+
+@pytest.mark.parametrize("t, v, head_v", [
+    ([0, 1, 2, 1], [0, 3, 200, 70000], 3054225),  # integer deltas
+    ([0, 1, 1, 1], [0, 0.1, 0.2, -0.1], 21.5),  # float deltas
+    ([0, 1, 1], [0, 2 ** 40, -2 ** 40], 0),  # wide integer deltas
+    ([0, 1, 1], [0, 2.0 ** 60, 1.0], 0),  # beyond exact float integers
+    ([0, 10], [0, float("nan")], 1.0),
+    ([], [], 0),  # empty block
+])
+def test_gz2bin_roundtrip(t, v, head_v):
+    blk = jblock(BID, t, v, head_v)
+    expected = tmpo._blk2arrays("gz", blk)
+    bin_blk, arrays = tmpo._gz2bin(blk)
+    for decoded in (arrays, tmpo._blk2arrays(tmpo.BIN_EXT, bin_blk)):
+        assert decoded[0].dtype == np.int64
+        np.testing.assert_array_equal(decoded[0], expected[0])
+        np.testing.assert_array_equal(decoded[1], expected[1])
+
+
+def null_block(t, v, head_v):
+    """Gzip json block whose deltas may hold nulls"""
+    data = {"h": {"head": [BID, head_v], "tail": [BID, head_v]},
+            "t": t, "v": v}
+    return gzip.compress(json.dumps(data, separators=(",", ":")).encode())
+
+
+def test_null_deltas():
+    blk = null_block([0, 60, 60], [0, None, 1], 5)
+    t, v = tmpo._blk2arrays("gz", blk)
+    np.testing.assert_array_equal(t, [BID, BID + 60, BID + 120])
+    np.testing.assert_array_equal(v, [5, np.nan, np.nan])
+    bin_blk, arrays = tmpo._gz2bin(blk)
+    for decoded in (arrays, tmpo._blk2arrays(tmpo.BIN_EXT, bin_blk)):
+        np.testing.assert_array_equal(decoded[0], t)
+        np.testing.assert_array_equal(decoded[1], v)
+    with pytest.raises((TypeError, ValueError)):
+        tmpo._blk2arrays("gz", null_block([0, None], [0, 1], 5))
+
+
+def test_sync_float_values(api, session):
+    sid = "%032x" % 1
+    blk = jblock(BID, [0, 60, 60], [0, 0.1, 0.1], 21.5)
+    api.sensors[sid] = {(8, BID): blk}
+    expected = tmpo._blk2arrays("gz", blk)[1]
+    s = session()
+    s.add(sid, "t")
+    assert s.sync() == {sid: 1}
+    assert s.list(sid)[0][0][4] == tmpo.BIN_EXT
+    np.testing.assert_array_equal(s.series(sid).values, expected)
+    gz = session(codec="gz")
+    gz.reset(sid)
+    gz.sync()
+    assert gz.transcode() == {sid: 1}
+    np.testing.assert_array_equal(gz.series(sid).values, expected)
+
+
+def test_sync_corrupt_block(api, session):
+    good, bad = "%032x" % 1, "%032x" % 2
+    api.sensors[good] = {(8, BID): jblock(BID, [0, 60], [0, 1])}
+    api.sensors[bad] = {(8, BID - 256): jblock(BID - 256, [0, 60], [0, 1]),
+                        (8, BID): b"not a block"}
+    s = session()
+    s.add(good, "t")
+    s.add(bad, "t")
+    results = s.sync()
+    assert results[good] == 1
+    assert isinstance(results[bad], Exception)
+    # the blocks before the corrupt one are kept
+    assert [row[3] for row in s.list(bad)[0]] == [BID - 256]
@@ -0,0 +1,125 @@
+import os
+
+import pandas as pd
+import pytest
+
+import tmpo
+from conftest import NOW, jblock
+
+pytest.importorskip("pyarrow")
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)
+TAIL = (NOW - 86400) >> 12 << 12
+SID = "%032x" % 1
+
+
+@pytest.fixture
+def synced(api, session):
+    api.add(SID, HEAD, TAIL + 100)
+    s = session(storage="columnar")
+    s.add(SID, "t")
+    s.sync()
+    return s
+
+
+@pytest.fixture
+def reference(api, tmp_path_factory):
+    """A session of its own on plain SQLite storage, as the block data of
+    columnar storage is not kept in the tmpo table"""
+    s = tmpo.Session(str(tmp_path_factory.mktemp("reference")))
+    api.use(s)
+    s.add(SID, "t")
+    yield s
+    s.close()
+
+
+def files(s, root=None):
+    """Files under the directory of the sensor, or another root"""
+    root = os.path.join(s.storage.root, SID) if root is None else root
+    return sorted(os.path.relpath(os.path.join(d, name), root)
+                  for d, dirs, names in os.walk(root) for name in names)
+
+
+def staged(s):
+    return files(s, s.storage.staging)
+
+
+def assert_blocks(reference, s):
+    """The windows hold the samples of the blocks stored in reference"""
+    pd.testing.assert_series_equal(s.series(SID, datetime=False),
+                                   reference.series(SID, datetime=False))
+
+
+def put_middle(s, api):
+    """Store a block in the middle of the history with other samples"""
+    blocks = sorted(api.sensors[SID], key=lambda block: block[1])
+    lvl, bid = blocks[len(blocks) // 2]
+    content = jblock(bid, [0] + [60] * 9, [1] * 10, head_v=-5)
+    rows, arrays, e = s._block_rows(
+        SID, [{"rid": 0, "lvl": lvl, "bid": bid, "ext": "gz"}], [content])
+    assert e is None
+    s.dbcur.execute("DELETE FROM tmpo WHERE sid = ? AND lvl = ? AND bid = ?",
+                    (SID, lvl, bid))
+    s.storage.put(rows, arrays)
+    return bid
+
+
+def test_sync(api, reference, synced):
+    reference.sync()
+    assert_blocks(reference, synced)
+    assert files(synced) and staged(synced) == []
+    api.add(SID, HEAD, NOW)
+    assert synced.sync()[SID] > 0
+    reference.sync()
+    assert_blocks(reference, synced)
+    assert staged(synced) == []
+
+
+def test_replace_rollback(api, reference, synced):
+    before = synced.series(SID, datetime=False)
+    names = files(synced)
+    with pytest.raises(RuntimeError):
+        with synced.transaction():
+            put_middle(synced, api)
+            # not swapped in before the commit
+            pd.testing.assert_series_equal(
+                synced.series(SID, datetime=False), before)
+            assert staged(synced) != []
+            raise RuntimeError("rollback")
+    pd.testing.assert_series_equal(synced.series(SID, datetime=False),
+                                   before)
+    assert files(synced) == names and staged(synced) == []
+    with synced.transaction():
+        put_middle(synced, api)
+    reference.sync()
+    with reference.transaction():
+        put_middle(reference, api)
+    assert_blocks(reference, synced)
+    assert not synced.series(SID, datetime=False).equals(before)
+    assert staged(synced) == []
+
+
+def test_remove_rollback(session, synced):
+    names = files(synced)
+    with pytest.raises(RuntimeError):
+        with synced.transaction():
+            synced.remove(SID)
+            raise RuntimeError("rollback")
+    assert files(synced) == names
+    synced.remove(SID)
+    assert not os.path.exists(os.path.join(synced.storage.root, SID))
+
+
+def test_reset_put(api, reference, synced):
+    """Windows written after a reset in the same transaction survive it"""
+    with synced.transaction():
+        put_middle(synced, api)
+        synced.reset(SID)
+        bid = put_middle(synced, api)
+    with reference.transaction():
+        reference.reset(SID)
+        put_middle(reference, api)
+    window = 1 << 16
+    assert files(synced) == ["0/%d.arrow" % (bid - bid % window)]
+    assert staged(synced) == []
+    assert_blocks(reference, synced)
@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+import tmpo
+import tmpo.daemon
+from tmpo.daemon import SyncDaemon, _Budget, _due
+from conftest import NOW
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)
+SIDS = ["%032x" % i for i in range(3)]
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tmpo.daemon, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def daemon(api, session):
+    for sid in SIDS:
+        api.add(sid, HEAD, NOW)
+    s = session()
+    for sid in SIDS:
+        s.add(sid, "t")
+    return SyncDaemon(s, rate=1000, jitter=0, stats_interval=0)
+
+
+def test_due():
+    assert _due(None, None) == 0
+    # the last lvl 8 block is still being filled
+    assert _due(8, NOW) == NOW + 256
+    # a complete higher level block is followed by a first lvl 8 block
+    assert _due(12, NOW) == NOW + 4096 + 256
+
+
+def test_budget(clock):
+    budget = _Budget(10, 0.5)
+    assert [budget.acquire() for _ in range(5)] == [0] * 5
+    assert budget.acquire() == pytest.approx(0.1)
+    clock.now += 0.25
+    assert budget.acquire() == 0
+    assert budget.acquire() == 0
+    assert budget.acquire() == pytest.approx(0.05)
+    assert budget.taken == 7
+    # a long idle time refills the bucket up to its size only
+    clock.now += 60
+    assert [budget.acquire() for _ in range(5)] == [0] * 5
+    assert budget.acquire() > 0
+
+
+def test_rate(api, session, monkeypatch):
+    """Every request of a sync, not every sensor, takes from the budget"""
+    monkeypatch.setattr(tmpo.daemon, "DAEMON_BURST", 0.05)
+    for sid in SIDS:
+        api.add(sid, HEAD, NOW)
+    s = session()
+    for sid in SIDS:
+        s.add(sid, "t")
+    d = SyncDaemon(s, rate=100, jitter=0, stats_interval=0)
+    t0 = time.time()
+    d.step()
+    dt = time.time() - t0
+    requests = sum(len(api.sensors[sid]) + 1 for sid in SIDS)
+    assert d.stats()["requests"] == requests
+    assert dt >= (requests - d.budget.size) / 100.0 * 0.9
+
+
+def test_schedule(api, daemon):
+    d = daemon
+    d.step()
+    stats = d.stats()
+    assert stats["sensors"] == 3
+    assert stats["syncs"] == 3
+    assert stats["errors"] == 0
+    assert stats["backoff"] == 0
+    assert stats["blocks"] == sum(len(api.sensors[sid]) for sid in SIDS)
+    # the served history is long over, the next block is due right away
+    pos = dict((sid, (lvl, bid)) for sid, lvl, bid
+               in d.session.dbcur.execute(tmpo.SQL_SYNC_POS))
+    for sid in SIDS:
+        assert _due(*pos[sid]) < time.time()
+        assert d._sensors[sid][0] <= time.time()
+    for sid in SIDS:
+        last = d.session.last_datapoint(sid, epoch=True)[0]
+        assert stats["lag"][sid] == pytest.approx(time.time() - last, abs=5)
+
+
+def test_backoff(api, daemon, monkeypatch):
+    d = daemon
+    d.step()
+    # nothing new: every sensor backs off, doubling on each miss
+    t0 = time.time()
+    d.step()
+    assert d.stats()["backoff"] == 3
+    for sid in SIDS:
+        assert d._sensors[sid][1] == 1
+        assert d._sensors[sid][0] >= t0 + tmpo.daemon.DAEMON_BACKOFF
+    wait = d.step()
+    assert tmpo.daemon.DAEMON_BACKOFF - 5 < wait <= \
+        tmpo.daemon.DAEMON_BACKOFF
+    d._sync(SIDS)
+    for sid in SIDS:
+        assert d._sensors[sid][1] == 2
+        assert d._sensors[sid][0] >= t0 + 2 * tmpo.daemon.DAEMON_BACKOFF
+    # failures back off and are counted as errors
+    monkeypatch.setattr(tmpo, "HTTP_RETRIES", 0)
+    api.errors = 1.0
+    d._sync(SIDS[2:])
+    assert d.stats()["errors"] == 1
+    assert d._sensors[SIDS[2]][1] == 3
+    assert d._sensors[SIDS[2]][0] >= t0 + 4 * tmpo.daemon.DAEMON_BACKOFF
+    api.errors = 0.0
+    # removed sensors are dropped on refresh
+    d.session.remove(SIDS[0])
+    d.refresh()
+    assert d.stats()["sensors"] == 2
+    assert SIDS[0] not in d.stats()["lag"]
+
+
+def test_async_limiter(api, tmp_path):
+    aio = pytest.importorskip("tmpo.aio")
+    for sid in SIDS:
+        api.add(sid, HEAD, NOW)
+    budget = _Budget(1000, 0.01)
+
+    async def run():
+        async with aio.AsyncSession(str(tmp_path)) as a:
+            api.use(a.session)
+            for sid in SIDS:
+                await a.add(sid, "t")
+            return await a.sync(limiter=budget)
+
+    results = asyncio.run(run())
+    assert results == dict((sid, len(api.sensors[sid])) for sid in SIDS)
+    assert budget.taken == sum(len(api.sensors[sid]) + 1 for sid in SIDS)
@@ -0,0 +1,123 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import tmpo
+from conftest import NOW, jblock
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+HEAD = 1495670400  # 2017-05-25
+JULY = 1498867200  # 2017-07-01
+SID = "%032x" % 1
+MONTHS = ["2017-05", "2017-06", "2017-07"]
+
+
+@pytest.fixture
+def synced(api, session):
+    api.add(SID, HEAD, NOW)
+    s = session()
+    s.add(SID, "t")
+    s.sync()
+    return s
+
+
+def read(path, sid=SID):
+    """Exported samples of a sensor, by month"""
+    months = {}
+    root = os.path.join(path, "sid=%s" % sid)
+    for month in sorted(os.listdir(root)):
+        for name in os.listdir(os.path.join(root, month)):
+            fname = os.path.join(root, month, name)
+            if name.endswith(".parquet"):
+                table = pq.read_table(fname)
+            else:
+                table = pa.ipc.open_file(pa.memory_map(fname)).read_all()
+            months[month[len("month="):]] = table.to_pandas()
+    return months
+
+
+def assert_exported(s, path):
+    months = read(path)
+    df = pd.concat([months[m] for m in sorted(months)])
+    ts = s.series(SID)
+    assert (df["timestamp"].values == ts.index.values).all()
+    assert (df["value"].values == ts.values).all()
+    return months
+
+
+def manifest(path):
+    with open(os.path.join(path, tmpo.EXPORT_MANIFEST)) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export(synced, tmp_path, workers):
+    path = str(tmp_path / "export")
+    assert synced.export(path, workers=workers) == {SID: 3}
+    assert sorted(assert_exported(synced, path)) == MONTHS
+    created, = synced.dbcur.execute(
+        "SELECT MAX(created) FROM tmpo WHERE sid = ?", (SID,)).fetchone()
+    assert manifest(path) == {SID: {
+        "rid": 0, "head": 0, "tail": tmpo.EPOCHS_MAX, "format": "parquet",
+        "created": created}}
+
+
+def test_incremental(api, synced, tmp_path):
+    path = str(tmp_path / "export")
+    synced.export(path, workers=1)
+    before = read(path)
+    # nothing new, nothing rewritten
+    assert synced.export(path, workers=1) == {SID: 0}
+    api.add(SID, HEAD, NOW + 86400)
+    synced.sync()
+    assert synced.export(path, workers=1) == {SID: 1}
+    after = assert_exported(synced, path)
+    for month in MONTHS[:-1]:
+        pd.testing.assert_frame_equal(after[month], before[month])
+    assert len(after["2017-07"]) > len(before["2017-07"])
+    assert manifest(path)[SID]["created"] > 0
+
+
+def test_format_change(synced, tmp_path):
+    path = str(tmp_path / "export")
+    synced.export(path, workers=1)
+    assert synced.export(path, format="arrow", workers=1) == {SID: 3}
+    names = [name for d, dirs, names in os.walk(path) for name in names]
+    assert sorted(names) == sorted(
+        ["%s-%s.arrow" % (SID, m) for m in MONTHS] + [tmpo.EXPORT_MANIFEST])
+    assert_exported(synced, path)
+    assert manifest(path)[SID]["format"] == "arrow"
+    with pytest.raises(NotImplementedError):
+        synced.export(path, format="csv")
+
+
+def test_interval(synced, tmp_path):
+    """A changed interval exports the sensor over again"""
+    path = str(tmp_path / "export")
+    synced.export(path, workers=1)
+    assert synced.export(path, head=JULY, workers=1) == {SID: 1}
+    months = read(path)
+    assert sorted(months) == ["2017-07"]
+    assert (months["2017-07"]["timestamp"] >=
+            pd.Timestamp(JULY, unit="s", tz="UTC")).all()
+
+
+def test_empty_month(api, session, tmp_path):
+    """A block that crosses into a month without samples of it does not
+    leave a partition there"""
+    s = session()
+    s.add(SID, "t")
+    bid = JULY >> 12 << 12
+    content = jblock(bid, [0] + [60] * 9, [1] * 10)
+    with s.transaction():
+        rows, arrays, e = s._block_rows(
+            SID, [{"rid": 0, "lvl": 12, "bid": bid, "ext": "gz"}], [content])
+        assert e is None
+        s._write_blocks(rows, arrays)
+    path = str(tmp_path / "export")
+    assert s.export(path, workers=1) == {SID: 1}
+    assert sorted(read(path)) == ["2017-06"]
@@ -0,0 +1,49 @@
+import re
+
+import pytest
+
+import tmpo
+from conftest import NOW
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)
+SID = "%032x" % 1
+
+
+def documented():
+    """Timer and counter names listed in the Metrics docstring"""
+    return set(re.findall(r"[a-z]+\.[a-z]+", tmpo.Metrics.__doc__))
+
+
+@pytest.mark.parametrize("storage, codec", [
+    ("sqlite", "bin"), ("sqlite", "gz"), ("mmap", "bin")])
+def test_sync_and_read(api, session, storage, codec):
+    api.add(SID, HEAD, NOW)
+    s = session(metrics=tmpo.MemoryMetrics(), storage=storage, codec=codec,
+                series_cache=1 << 20)
+    s.add(SID, "t")
+    s.sync()
+    summary = s.metrics.summary()
+    blocks = len(api.sensors[SID])
+    assert summary["http.sync"]["count"] >= 1
+    assert summary["http.block"]["count"] == blocks
+    # the blocks and the listings
+    assert summary["http.bytes"] > sum(
+        len(content) for content in api.sensors[SID].values())
+    assert summary["db.encode"]["count"] == blocks
+    assert summary["db.write"]["count"] >= 1
+    s.metrics.reset()
+    s.series(SID)
+    s.series(SID)
+    summary = s.metrics.summary()
+    assert summary["series.miss"] == 1 and summary["series.hit"] == 1
+    assert summary["series.concat"]["count"] == 2
+    if storage == "sqlite":
+        assert summary["cache.miss"] == blocks
+        decode = "decode.bin" if codec == "bin" else "decode.parse"
+        assert summary[decode]["count"] == blocks
+    else:
+        assert summary["mmap.read"]["count"] >= 1
+    for name, value in summary.items():
+        assert name in documented()
+        if isinstance(value, dict):
+            assert value["min"] >= 0 and value["count"] > 0
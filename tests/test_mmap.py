@@ -0,0 +1,131 @@
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import NOW, jblock
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)
+TAIL = (NOW - 86400) >> 12 << 12  # blocks past it stay at lvl 8
+SID = "%032x" % 1
+
+
+@pytest.fixture
+def synced(api, session):
+    api.add(SID, HEAD, TAIL + 100)
+    s = session(storage="mmap")
+    s.add(SID, "t")
+    s.sync()
+    return s
+
+
+def files(s):
+    return sorted(os.listdir(os.path.join(s.storage.root, SID)))
+
+
+def assert_blocks(session, s):
+    """The arrays hold the samples of the stored blocks"""
+    pd.testing.assert_series_equal(s.series(SID, datetime=False),
+                                   session().series(SID, datetime=False))
+
+
+def put_middle(s, api):
+    """Store a block in the middle of the history with other samples"""
+    blocks = sorted(api.sensors[SID], key=lambda block: block[1])
+    lvl, bid = blocks[len(blocks) // 2]
+    content = jblock(bid, [0] + [60] * 9, [1] * 10, head_v=-5)
+    rows, arrays, e = s._block_rows(
+        SID, [{"rid": 0, "lvl": lvl, "bid": bid, "ext": "gz"}], [content])
+    assert e is None
+    s.dbcur.execute("DELETE FROM tmpo WHERE sid = ? AND lvl = ? AND bid = ?",
+                    (SID, lvl, bid))
+    s.storage.put(rows, arrays)
+
+
+def test_append(api, session, synced):
+    assert_blocks(session, synced)
+    assert files(synced) == ["0.0.t", "0.0.v"]
+    # the last block grows and new ones follow, the array is appended to
+    api.add(SID, HEAD, TAIL + 1000)
+    assert synced.sync()[SID] > 0
+    assert_blocks(session, synced)
+    assert files(synced) == ["0.0.t", "0.0.v"]
+
+
+def test_replace(api, session, synced):
+    before = synced.series(SID, datetime=False)
+    with pytest.raises(RuntimeError):
+        with synced.transaction():
+            put_middle(synced, api)
+            raise RuntimeError("rollback")
+    # the recorded version is untouched
+    pd.testing.assert_series_equal(synced.series(SID, datetime=False),
+                                   before)
+    assert_blocks(session, synced)
+    with synced.transaction():
+        put_middle(synced, api)
+    assert_blocks(session, synced)
+    assert not synced.series(SID, datetime=False).equals(before)
+    assert files(synced) == ["0.1.t", "0.1.v"]
+
+
+@pytest.mark.parametrize("damage", ["remove", "truncate"])
+def test_rebuild(api, session, synced, damage):
+    if damage == "remove":
+        shutil.rmtree(synced.storage.root)
+    else:
+        with open(os.path.join(synced.storage.root, SID, "0.0.t"),
+                  "r+b") as f:
+            f.truncate(8)
+    assert_blocks(session, synced)
+    api.add(SID, HEAD, NOW)
+    synced.sync()
+    assert_blocks(session, synced)
+
+
+def test_remove_rollback(session, synced):
+    with pytest.raises(RuntimeError):
+        with synced.transaction():
+            synced.remove(SID)
+            raise RuntimeError("rollback")
+    assert files(synced) == ["0.0.t", "0.0.v"]
+    synced.remove(SID)
+    assert not os.path.exists(os.path.join(synced.storage.root, SID))
+
+
+def test_migrate_again(session, synced):
+    """Every migration step can run again on a database that has it"""
+    synced.close()
+    con = sqlite3.connect(synced.db)
+    con.execute("PRAGMA user_version = 0")
+    con.commit()
+    con.close()
+    s = session(storage="mmap")
+    version, = s.dbcur.execute("PRAGMA user_version").fetchone()
+    assert version == len(s._migrations())
+    # the versioned arrays are kept
+    assert files(s) == ["0.0.t", "0.0.v"]
+    assert_blocks(session, s)
+    assert files(s) == ["0.0.t", "0.0.v"]
+
+
+def test_migrate_unversioned(session, synced, tmp_path):
+    """Arrays written before they were versioned are rebuilt"""
+    root = synced.storage.root
+    synced.close()
+    con = sqlite3.connect(synced.db)
+    con.execute("PRAGMA user_version = %d" % (len(synced._migrations()) - 1))
+    con.execute("DROP TABLE tmpo_array")
+    con.execute("CREATE TABLE tmpo_array(sid TEXT, rid INTEGER, n INTEGER, "
+                "PRIMARY KEY(sid, rid))")
+    con.execute("INSERT INTO tmpo_array VALUES (?, 0, 1)", (SID,))
+    con.commit()
+    con.close()
+    for name in os.listdir(os.path.join(root, SID)):
+        os.rename(os.path.join(root, SID, name),
+                  os.path.join(root, SID, name.replace(".0.", ".")))
+    s = session(storage="mmap")
+    assert_blocks(session, s)
+    assert files(s) == ["0.0.t", "0.0.v"]
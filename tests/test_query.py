@@ -0,0 +1,311 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tmpo
+from conftest import NOW, jblock, reference
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)
+SIDS = ["%032x" % i for i in range(3)]
+
+
+@pytest.fixture
+def synced(api, session):
+    """Sensors over different intervals, the last one without blocks"""
+    api.add(SIDS[0], HEAD, NOW)
+    api.add(SIDS[1], HEAD + 40000, NOW - 20000)
+    s = session()
+    for sid in SIDS:
+        s.add(sid, "t")
+    s.sync()
+    return s
+
+
+@pytest.mark.parametrize("epoch_dtype, value_dtype", [
+    (np.int64, np.float64), (np.int32, np.float32), (np.uint32, np.int64),
+    ("int64", "int32")])
+def test_array_dtypes(api, synced, epoch_dtype, value_dtype):
+    t, v = synced.array(SIDS[0], epoch_dtype=epoch_dtype,
+                        value_dtype=value_dtype)
+    assert t.dtype == np.dtype(epoch_dtype)
+    assert v.dtype == np.dtype(value_dtype)
+    rt, rv = reference(api, SIDS[0])
+    np.testing.assert_array_equal(t, rt)
+    np.testing.assert_array_equal(v, rv.astype(value_dtype))
+
+
+@pytest.mark.parametrize("epoch_dtype", [
+    np.int16, np.uint16, np.float64, np.float32])
+def test_array_epoch_dtype(synced, epoch_dtype):
+    with pytest.raises(ValueError):
+        synced.array(SIDS[0], epoch_dtype=epoch_dtype)
+
+
+@pytest.mark.parametrize("value_dtype", [np.bool_, np.complex128, object])
+def test_array_value_dtype(synced, value_dtype):
+    with pytest.raises(ValueError):
+        synced.array(SIDS[0], value_dtype=value_dtype)
+
+
+def test_array_overflow(api, synced):
+    rv = reference(api, SIDS[0])[1]
+    assert rv.max() > np.iinfo(np.uint8).max
+    for value_dtype in (np.int8, np.uint8):
+        with pytest.raises(ValueError):
+            synced.array(SIDS[0], value_dtype=value_dtype)
+
+
+def test_arrays(synced):
+    """Each sensor keeps its own timestamps, as array() returns them"""
+    head, tail = HEAD + 30000, NOW - 30000
+    arrays = synced.arrays(SIDS, head=head, tail=tail,
+                           epoch_dtype=np.int32, value_dtype=np.float32)
+    assert list(arrays) == SIDS
+    for sid in SIDS:
+        t, v = synced.array(sid, head=head, tail=tail,
+                            epoch_dtype=np.int32, value_dtype=np.float32)
+        np.testing.assert_array_equal(arrays[sid][0], t)
+        np.testing.assert_array_equal(arrays[sid][1], v)
+        assert arrays[sid][0].dtype == np.int32
+        assert arrays[sid][1].dtype == np.float32
+    assert arrays[SIDS[0]][0][0] < arrays[SIDS[1]][0][0]
+    assert len(arrays[SIDS[2]][0]) == 0
+    with pytest.raises(ValueError):
+        synced.arrays(SIDS, value_dtype=np.int8)
+
+
+def test_async_arrays(synced, tmp_path):
+    aio = pytest.importorskip("tmpo.aio")
+    head, tail = HEAD + 30000, NOW - 30000
+
+    async def run():
+        async with aio.AsyncSession(str(tmp_path)) as a:
+            array = await a.array(SIDS[1], head=head, tail=tail,
+                                  epoch_dtype="uint32", value_dtype="int64")
+            arrays = await a.arrays(SIDS, head=head, tail=tail)
+            with pytest.raises(ValueError):
+                await a.array(SIDS[0], epoch_dtype="int16")
+            return array, arrays
+
+    array, arrays = asyncio.run(run())
+    t, v = synced.array(SIDS[1], head=head, tail=tail,
+                        epoch_dtype=np.uint32, value_dtype=np.int64)
+    assert array[0].dtype == np.uint32 and array[1].dtype == np.int64
+    np.testing.assert_array_equal(array[0], t)
+    np.testing.assert_array_equal(array[1], v)
+    expected = synced.arrays(SIDS, head=head, tail=tail)
+    assert list(arrays) == SIDS
+    for sid in SIDS:
+        np.testing.assert_array_equal(arrays[sid][0], expected[sid][0])
+        np.testing.assert_array_equal(arrays[sid][1], expected[sid][1])
+
+
+def put_block(s, sid, rid, lvl, bid, t, v, head_v=0):
+    """Store a block of t and v deltas under a recycle id"""
+    content = jblock(bid, t, v, head_v=head_v)
+    with s.transaction():
+        rows, arrays, e = s._block_rows(
+            sid, [{"rid": rid, "lvl": lvl, "bid": bid, "ext": "gz"}],
+            [content])
+        assert e is None
+        s._write_blocks(rows, arrays)
+
+
+def assert_last(s, df, sids, epoch):
+    for sid in sids:
+        timestamp, value = s.last_datapoint(sid, epoch=epoch)
+        if timestamp is None:
+            assert df.loc[sid].isna().all()
+        else:
+            assert df.loc[sid, "timestamp"] == timestamp
+            assert df.loc[sid, "value"] == value
+
+
+@pytest.mark.parametrize("epoch", [False, True])
+def test_last_datapoints(api, synced, epoch):
+    df = synced.last_datapoints(SIDS, epoch=epoch)
+    assert list(df.index) == SIDS
+    assert_last(synced, df, SIDS, epoch)
+    for sid in SIDS[:2]:
+        t, v = reference(api, sid)
+        assert df.loc[sid, "value"] == v[-1]
+    assert df.loc[SIDS[0], "timestamp"] == (
+        NOW if epoch else synced._2timestamp(NOW))
+    # all sensors with data
+    df = synced.last_datapoints(epoch=epoch)
+    assert sorted(df.index) == SIDS[:2]
+    assert_last(synced, df, SIDS[:2], epoch)
+
+
+def test_last_datapoints_many(synced, monkeypatch):
+    """Sensors are looked up in chunks of bound parameters"""
+    monkeypatch.setattr(tmpo, "SQLITE_VARIABLES", 2)
+    sids = SIDS + ["%032x" % 9] + SIDS[:1]
+    df = synced.last_datapoints(sids, epoch=True)
+    assert list(df.index) == sids
+    assert df.iloc[-1].equals(df.iloc[0])
+    assert_last(synced, df[:-1], sids[:-1], True)
+
+
+def test_last_datapoints_recycled(synced):
+    """The last sample over all recycle ids of a sensor"""
+    sid = SIDS[2]
+    put_block(synced, sid, 0, 8, NOW >> 8 << 8, [0, 60], [1, 1], head_v=5)
+    put_block(synced, sid, 1, 8, (NOW >> 8 << 8) - 4096, [0, 60], [1, 1],
+              head_v=10)
+    df = synced.last_datapoints([sid], epoch=True)
+    assert df.loc[sid, "value"] == 7
+    assert_last(synced, df, [sid], True)
+    put_block(synced, sid, 1, 8, (NOW >> 8 << 8) + 256, [0, 60], [1, 1],
+              head_v=10)
+    df = synced.last_datapoints([sid], epoch=True)
+    assert df.loc[sid, "value"] == 12
+    assert_last(synced, df, [sid], True)
+
+
+@pytest.fixture(params=["sqlite", "mmap", "columnar"])
+def stored(request, api, session):
+    """A sensor synced to each storage"""
+    if request.param == "columnar":
+        pytest.importorskip("pyarrow")
+    api.add(SIDS[0], HEAD, NOW)
+    s = session(storage=request.param)
+    s.add(SIDS[0], "t")
+    s.sync()
+    return s
+
+
+def join(blocks):
+    blocks = list(blocks)
+    for t, v in blocks:
+        assert len(t) > 0 and len(t) == len(v)
+    if not blocks:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(a) for a in zip(*blocks))
+
+
+@pytest.mark.parametrize("head, tail", [
+    (None, None), (HEAD + 1000, NOW - 1000), (HEAD + 4096, HEAD + 4096),
+    (NOW + 1, None), (None, HEAD - 1)])
+def test_iter_blocks(stored, head, tail):
+    t, v = join(stored.iter_blocks(SIDS[0], head=head, tail=tail))
+    et, ev = stored.array(SIDS[0], head=head, tail=tail)
+    np.testing.assert_array_equal(t, et)
+    np.testing.assert_array_equal(v, ev)
+    assert (np.diff(t) > 0).all()
+
+
+def test_iter_series(stored):
+    head = pd.Timestamp(HEAD + 1000, unit="s", tz="UTC")
+    tail = pd.Timestamp(NOW - 1000, unit="s", tz="UTC")
+    parts = list(stored.iter_series(SIDS[0], head=head, tail=tail))
+    assert len(parts) > 0
+    pd.testing.assert_series_equal(
+        pd.concat(parts), stored.series(SIDS[0], head=head, tail=tail))
+    parts = list(stored.iter_series(SIDS[0], datetime=False))
+    pd.testing.assert_series_equal(
+        pd.concat(parts), stored.series(SIDS[0], datetime=False))
+
+
+def test_iter_recycled(stored):
+    bid = (NOW >> 8 << 8) + 256
+    put_block(stored, SIDS[0], 1, 8, bid, [0, 60], [1, 1], head_v=10)
+    t, v = join(stored.iter_blocks(SIDS[0]))
+    np.testing.assert_array_equal(t, [bid, bid + 60])
+    np.testing.assert_array_equal(v, [11, 12])
+    t, v = join(stored.iter_blocks(SIDS[0], recycle_id=0))
+    np.testing.assert_array_equal(t, stored.array(SIDS[0], recycle_id=0)[0])
+    assert list(stored.iter_blocks(SIDS[0], recycle_id=2)) == []
+
+
+def test_iter_cleaned(stored):
+    """Blocks cleaned while an iteration runs do not break it"""
+    blocks = stored.storage.blocks(SIDS[0], 0, HEAD, NOW)
+    before = stored.array(SIDS[0])
+    it = stored.iter_blocks(SIDS[0])
+    first = next(it)
+    with stored.transaction():
+        stored.storage.clean([(SIDS[0], 0, lvl, bid)
+                              for lvl, bid, created in blocks])
+    t, v = join([first] + list(it))
+    assert (np.diff(t) > 0).all()
+    assert np.isin(t, before[0]).all()
+    assert len(stored.array(SIDS[0])[0]) == 0
+    assert list(stored.iter_blocks(SIDS[0])) == []
+
+
+def grid_reference(t, v, grid, fill):
+    """Values of samples t, v at the grid points, in plain python"""
+    out = []
+    for g in grid:
+        before = [i for i in range(len(t)) if t[i] <= g]
+        after = [i for i in range(len(t)) if t[i] >= g]
+        i = None
+        if fill == "ffill" and before:
+            i = before[-1]
+        elif fill == "bfill" and after:
+            i = after[0]
+        elif fill == "nearest" and (before or after):
+            if not after or (before and g - t[before[-1]] <= t[after[0]] - g):
+                i = before[-1]
+            else:
+                i = after[0]
+        elif fill is None and before and t[before[-1]] == g:
+            i = before[-1]
+        elif fill == "linear" and before and after:
+            a, b = before[-1], after[0]
+            out.append(v[a] if a == b else v[a] + (v[b] - v[a]) *
+                       (g - t[a]) / float(t[b] - t[a]))
+            continue
+        out.append(np.nan if i is None else v[i])
+    return np.array(out)
+
+
+@pytest.mark.parametrize("fill", ["ffill", "bfill", "nearest", "linear", None])
+def test_dataframe_fill(synced, fill):
+    # head and tail fall between grid points, and the second sensor starts
+    # after the grid does
+    head, tail = HEAD + 39917, HEAD + 40913
+    df = synced.dataframe(SIDS, head=head, tail=tail, datetime=False,
+                          freq=120, fill=fill)
+    grid = df.index.values
+    assert list(df.columns) == SIDS
+    assert grid[0] == -(-head // 120) * 120
+    assert grid[-1] <= tail < grid[-1] + 120
+    assert (np.diff(grid) == 120).all()
+    for sid in SIDS:
+        t, v = synced.array(sid, head=head, tail=tail)
+        np.testing.assert_array_equal(
+            df[sid].values, grid_reference(t, v, grid, fill))
+    assert df[SIDS[2]].isna().all()
+    if fill is None:
+        # the synthetic samples are not on the grid
+        assert df[SIDS[0]].isna().sum() > 0
+
+
+def test_dataframe_freq(synced):
+    head, tail = HEAD + 30000, HEAD + 50000
+    df = synced.dataframe(SIDS[:2], head=head, tail=tail, freq="5min")
+    pd.testing.assert_frame_equal(df, synced.dataframe(
+        SIDS[:2], head=head, tail=tail, freq=300))
+    pd.testing.assert_frame_equal(df, synced.dataframe(
+        SIDS[:2], head=head, tail=tail, freq=np.int64(300)))
+    assert (df.index[1:] - df.index[:-1] == pd.Timedelta(minutes=5)).all()
+    assert df.index[0] >= pd.Timestamp(head, unit="s", tz="UTC")
+
+
+@pytest.mark.parametrize("freq", [0, -60, "500ms", "1500ms", 0.5, "bogus"])
+def test_dataframe_bad_freq(synced, freq):
+    with pytest.raises(ValueError):
+        synced.dataframe(SIDS, freq=freq)
+
+
+@pytest.mark.parametrize("fill", ["cubic", "pad", ""])
+def test_dataframe_bad_fill(synced, fill):
+    with pytest.raises(NotImplementedError):
+        synced.dataframe(SIDS, freq=60, fill=fill)
+    # also without any data to fill
+    with pytest.raises(NotImplementedError):
+        synced.dataframe(SIDS[2:], freq=60, fill=fill)
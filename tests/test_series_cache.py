@@ -0,0 +1,146 @@
+import concurrent.futures
+import random
+
+import pandas as pd
+import pytest
+
+from conftest import NOW
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)
+SID = "%032x" % 1
+
+
+@pytest.fixture(params=["sqlite", "mmap", "columnar"])
+def storage(request):
+    if request.param == "columnar":
+        pytest.importorskip("pyarrow")
+    return request.param
+
+
+@pytest.fixture
+def sessions(api, session, storage):
+    """A session with a series cache and one without, on one database"""
+    cached = session(storage=storage, series_cache=1 << 26)
+    cached.add(SID, "t")
+    return cached, session(storage=storage)
+
+
+def check(sessions, head, tail):
+    cached, plain = sessions
+    ts = cached.series(SID, head=head, tail=tail, datetime=False)
+    expected = plain.series(SID, head=head, tail=tail, datetime=False)
+    if len(expected) == 0:
+        # the dtype of an empty window depends on the backend
+        assert len(ts) == 0
+    else:
+        pd.testing.assert_series_equal(ts, expected)
+
+
+def lvl12(api):
+    return min(bid for lvl, bid in api.sensors[SID] if lvl == 12)
+
+
+def test_widen(api, sessions):
+    api.add(SID, HEAD, NOW)
+    cached = sessions[0]
+    cached.sync()
+    bid = lvl12(api)
+    check(sessions, bid + 2000, bid + 8000)
+    check(sessions, bid - 1000, bid + 8000)
+    check(sessions, bid - 1000, bid + 20000)
+    check(sessions, HEAD, NOW)
+    stats = cached.series_cache.stats()
+    assert stats["series"] == 1 and stats["hits"] == 0
+    check(sessions, bid, bid + 10000)
+    assert cached.series_cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("side", ["head", "tail"])
+def test_widen_over_cleaned_block(api, sessions, side):
+    """A block crossing the edge of the entry that vanishes before it is
+    widened leaves no samples behind"""
+    api.add(SID, HEAD, NOW)
+    cached = sessions[0]
+    cached.sync()
+    bid = lvl12(api)
+    if side == "tail":
+        check(sessions, HEAD, bid + 2000)
+    else:
+        check(sessions, bid + 2000, bid + 8000)
+    with cached.transaction():
+        cached.storage.clean([(SID, 0, 12, bid)])
+    check(sessions, HEAD, bid + 8000)
+    check(sessions, HEAD, NOW)
+
+
+def test_incremental_sync(api, sessions):
+    """Random windows over a history that grows, with blocks also dropped
+    at random as a reset or another process would"""
+    rnd = random.Random(23)
+    head = NOW - 2 * 86400
+    tail = NOW - 86400
+    cached = sessions[0]
+    for step in range(40):
+        tail += rnd.randint(0, 3000)
+        api.add(SID, head, tail)
+        cached.sync()
+        if rnd.random() < 0.3:
+            blocks = cached.storage.blocks(SID, 0, head, tail)
+            lvl, bid, created = rnd.choice(blocks)
+            with cached.transaction():
+                cached.storage.clean([(SID, 0, lvl, bid)])
+        a, b = sorted(rnd.randint(head - 600, tail + 600) for _ in range(2))
+        check(sessions, a, b)
+        check(sessions, head, tail)
+
+
+def test_arrays_batched(api, sessions):
+    """The spans missed over several sensors are read in one call"""
+    sids = [SID, "%032x" % 2, "%032x" % 3]
+    cached, plain = sessions
+    for sid in sids:
+        cached.add(sid, "t")
+        api.add(sid, HEAD, NOW)
+    cached.sync()
+    calls = []
+    ranges = cached.storage.ranges
+
+    def counted(queries):
+        calls.append(queries)
+        return ranges(queries)
+
+    cached.storage.ranges = counted
+    for head, tail in [(NOW - 90000, NOW - 3000), (HEAD, NOW)]:
+        arrays = cached.arrays(sids, head, tail)
+        for sid, (t, v) in plain.arrays(sids, head, tail).items():
+            assert (arrays[sid][0] == t).all()
+            assert (arrays[sid][1] == v).all()
+    assert len(calls) == 2
+    assert set(query[0] for query in calls[-1]) == set(sids)
+
+
+def test_threads(api, sessions):
+    """Queries of several sensors from several threads agree with storage"""
+    sids = ["%032x" % i for i in range(1, 9)]
+    cached, plain = sessions
+    for sid in sids:
+        cached.add(sid, "t")
+        api.add(sid, HEAD, NOW)
+    cached.sync()
+    rnd = random.Random(9)
+    windows = [sorted(rnd.randint(HEAD, NOW) for _ in range(2))
+               for _ in range(64)]
+
+    def query(i):
+        sid = sids[i % len(sids)]
+        head, tail = windows[i]
+        return cached.series(sid, head=head, tail=tail, datetime=False)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(query, range(len(windows))))
+    for i, ts in enumerate(results):
+        head, tail = windows[i]
+        expected = plain.series(
+            sids[i % len(sids)], head=head, tail=tail, datetime=False)
+        assert (ts.index == expected.index).all()
+        assert (ts.values == expected.values).all()
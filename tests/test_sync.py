@@ -0,0 +1,251 @@
+import asyncio
+import random
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tmpo
+from conftest import NOW, reference
+
+HEAD = (NOW >> 20 << 20) - (1 << 20)  # aligned, so no block is superseded
+SIDS = ["%032x" % i for i in range(3)]
+
+
+def assert_synced(api, s, sid):
+    ts = s.series(sid, datetime=False)
+    t, v = reference(api, sid)
+    np.testing.assert_array_equal(ts.index.values, t)
+    np.testing.assert_array_equal(ts.values, v)
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(tmpo, "HTTP_BACKOFF", 0.01)
+
+
+@pytest.mark.parametrize("codec", ["bin", "gz"])
+def test_sync(api, session, codec):
+    for sid in SIDS:
+        api.add(sid, HEAD, NOW)
+    s = session(codec=codec)
+    for sid in SIDS:
+        s.add(sid, "t")
+    results = s.sync()
+    assert results == dict((sid, len(api.sensors[sid])) for sid in SIDS)
+    for sid in SIDS:
+        assert_synced(api, s, sid)
+    df = s.dataframe(SIDS, datetime=False)
+    assert list(df.columns) == SIDS
+    # nothing new to fetch
+    assert s.sync() == dict((sid, 0) for sid in SIDS)
+
+
+def test_sync_incremental(api, session):
+    sid = SIDS[0]
+    api.add(sid, HEAD, NOW - 86400)
+    s = session()
+    s.add(sid, "t")
+    s.sync()
+    api.add(sid, HEAD, NOW)
+    assert s.sync()[sid] > 0
+    assert_synced(api, s, sid)
+
+
+def test_sync_unaligned_head(api, session):
+    """Blocks served before a larger one are not cleaned away"""
+    sid = SIDS[0]
+    api.add(sid, NOW - 20 * 86400 + 123, NOW)
+    s = session()
+    s.add(sid, "t")
+    s.sync()
+    assert_synced(api, s, sid)
+    assert s.series(sid, datetime=False).index[0] == NOW - 20 * 86400 + 123
+
+
+def test_sync_retry(api, session, fast_retries, monkeypatch):
+    monkeypatch.setattr(tmpo, "HTTP_RETRIES", 12)
+    random.seed(6)
+    api.errors = 0.2
+    for sid in SIDS:
+        api.add(sid, HEAD, NOW)
+    s = session()
+    for sid in SIDS:
+        s.add(sid, "t")
+    results = s.sync()
+    assert all(isinstance(n, int) for n in results.values()), results
+    for sid in SIDS:
+        assert_synced(api, s, sid)
+
+
+def test_sync_resume(api, session, fast_retries, monkeypatch):
+    monkeypatch.setattr(tmpo, "HTTP_RETRIES", 1)
+    good, bad = SIDS[:2]
+    api.add(good, HEAD, NOW)
+    api.add(bad, HEAD, NOW)
+    blocks = sorted(api.sensors[bad], key=lambda block: block[1])
+    lvl, bid = blocks[len(blocks) // 2]
+    api.fail.add((bad, lvl, bid))
+    s = session()
+    s.add(good, "t")
+    s.add(bad, "t")
+    results = s.sync()
+    assert results[good] == len(api.sensors[good])
+    assert isinstance(results[bad], Exception)
+    # the blocks before the failed one are kept
+    assert [row[2:4] for row in sorted(s.list(bad)[0], key=lambda r: r[3])] \
+        == [tuple(block) for block in blocks[:len(blocks) // 2]]
+    api.fail.clear()
+    assert s.sync(bad)[bad] > 0
+    assert_synced(api, s, bad)
+
+
+def test_sync_shared(api, session):
+    """Sessions syncing one database at once split the sensors"""
+    sids = ["%032x" % i for i in range(64)]
+    for sid in sids:
+        api.add(sid, NOW - 86400, NOW)
+    sessions = [session(workers=4) for _ in range(4)]
+    for sid in sids:
+        sessions[0].add(sid, "t")
+    barrier = threading.Barrier(len(sessions))
+    results = [None] * len(sessions)
+
+    def sync(i):
+        barrier.wait()
+        results[i] = sessions[i].sync()
+
+    threads = [threading.Thread(target=sync, args=(i,))
+               for i in range(len(sessions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(sid for r in results for sid in r) == sids
+    assert all(len(r) > 0 for r in results), [len(r) for r in results]
+    for sid in sids[::8]:
+        assert_synced(api, sessions[0], sid)
+
+
+def test_async_sync(api, tmp_path, fast_retries, monkeypatch):
+    aio = pytest.importorskip("tmpo.aio")
+    monkeypatch.setattr(aio, "HTTP_RETRIES", 1)
+    api.errors = 0.0
+    for sid in SIDS:
+        api.add(sid, HEAD, NOW)
+    blocks = sorted(api.sensors[SIDS[2]], key=lambda block: block[1])
+    api.fail.add((SIDS[2],) + blocks[-1])
+
+    async def run():
+        async with aio.AsyncSession(str(tmp_path)) as a:
+            api.use(a.session)
+            for sid in SIDS:
+                await a.add(sid, "t")
+            results = await a.sync()
+            api.fail.clear()
+            resumed = await a.sync(SIDS[2])
+            series = [await a.series(sid, datetime=False) for sid in SIDS]
+            grid = await a.dataframe(SIDS, head=HEAD, tail=HEAD + 3600,
+                                     freq=300, fill="nearest")
+            pd.testing.assert_frame_equal(grid, a.session.dataframe(
+                SIDS, head=HEAD, tail=HEAD + 3600, freq=300, fill="nearest"))
+            assert (grid.index[1:] - grid.index[:-1] ==
+                    pd.Timedelta(seconds=300)).all()
+            return results, resumed, series
+
+    results, resumed, series = asyncio.run(run())
+    assert results[SIDS[0]] == len(api.sensors[SIDS[0]])
+    assert isinstance(results[SIDS[2]], Exception)
+    assert resumed == {SIDS[2]: 1}
+    for sid, ts in zip(SIDS, series):
+        t, v = reference(api, sid)
+        np.testing.assert_array_equal(ts.index.values, t)
+        np.testing.assert_array_equal(ts.values, v)
+
+
+def test_migrate_baseline(api, session, tmp_path):
+    """A database written by tmpo 0.2.10, before schema versions"""
+    sid = SIDS[0]
+    api.add(sid, HEAD, NOW)
+    blocks = sorted(api.sensors[sid], key=lambda block: block[1])
+    home = tmp_path / ".tmpo"
+    home.mkdir()
+    con = sqlite3.connect(str(home / "tmpo.sqlite3"))
+    con.execute("CREATE TABLE sensor(sid TEXT, token TEXT, "
+                "PRIMARY KEY(sid))")
+    con.execute("CREATE TABLE tmpo(sid TEXT, rid INTEGER, lvl INTEGER, "
+                "bid INTEGER, ext TEXT, created REAL, data BLOB, "
+                "PRIMARY KEY(sid, rid, lvl, bid))")
+    con.execute("INSERT INTO sensor VALUES (?, ?)", (sid, "t"))
+    for i, (lvl, bid) in enumerate(blocks[:-2]):
+        con.execute("INSERT INTO tmpo VALUES (?, 0, ?, ?, 'gz', ?, ?)", (
+            sid, lvl, bid, 1.0 + i, api.sensors[sid][(lvl, bid)]))
+    con.commit()
+    con.close()
+
+    s = session()
+    version, = s.dbcur.execute("PRAGMA user_version").fetchone()
+    assert version == len(s._migrations())
+    columns = [c[1] for c in s.dbcur.execute("PRAGMA table_info(tmpo)")]
+    assert set(c.split()[0] for c in tmpo.SQL_TMPO_HEADER_COLUMNS) \
+        <= set(columns)
+    t, v = reference(api, sid)
+    last = blocks[-3]
+    n = int(np.searchsorted(t, last[1] + (1 << last[0])))
+    assert s.last_datapoint(sid, epoch=True) == (t[n - 1], v[n - 1])
+    # aggregates of migrated blocks match the raw samples
+    agg = s.aggregate(sid, freq="1D", how="sum", datetime=False)
+    raw = pd.Series(v[:n], index=t[:n])
+    expected = raw.groupby(raw.index // 86400 * 86400).sum()
+    np.testing.assert_allclose(agg.values, expected.values)
+    # sync carries on after the migrated blocks
+    assert s.sync()[sid] == 2
+    assert_synced(api, s, sid)
+
+
+def test_request_threads(session):
+    """Every outstanding request has a thread and a kept-alive connection"""
+    s = session(workers=4)
+    assert s.concurrency.limit == 4
+    assert s.concurrency.maximum == s.inflight == 16
+    assert s.rqs.executor._max_workers == s.inflight
+    assert s.rqs.get_adapter("http://localhost")._pool_maxsize == s.inflight
+
+
+@pytest.mark.parametrize("decoder", [None, "thread", "process"])
+def test_close(api, session, decoder):
+    api.add(SIDS[0], HEAD, NOW)
+    s = session(decoder=decoder)
+    s.add(SIDS[0], "t")
+    s.sync()
+    pool = s.decoder
+    s.close()
+    assert s.decoder is None
+    if pool is not None:
+        with pytest.raises(RuntimeError):
+            pool.submit(int)
+    with pytest.raises(RuntimeError):
+        s.rqs.executor.submit(int)
+    # queries reopen the database and decode in the calling thread
+    assert_synced(api, s, SIDS[0])
+    s.close()
+
+
+def test_readers(api, session):
+    """Reader connections of threads that exited are closed"""
+    api.add(SIDS[0], HEAD, NOW)
+    s = session()
+    s.add(SIDS[0], "t")
+    s.sync()
+    s.series(SIDS[0])
+    before = len(s._readers)
+    for i in range(4):
+        threads = [threading.Thread(target=s.series, args=(SIDS[0],))
+                   for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(s._readers) <= before
@@ -28,6 +28,10 @@ cKIo2x/YkVhuDmIpU/XVA13csXrXU+CLfFyNdY1a/6Dhv2B4wG6J5RGuxWmA+Igg
 TTysD+aqqzs8XstqDu/aLjMzFKMaXNvDoCbdFQGVXfx0F1A=
 -----END CERTIFICATE-----"""
 
+SQL_SCHEMA_VERSION = "PRAGMA user_version"
+
+SQL_SCHEMA_VERSION_SET = "PRAGMA user_version = %d"
+
 SQL_SENSOR_TABLE = """
     CREATE TABLE IF NOT EXISTS sensor(
     sid TEXT,
@@ -66,24 +70,100 @@ SQL_TMPO_TABLE = """
     ext TEXT,
     created REAL,
     data BLOB,
+    head_t INTEGER,
+    head_v REAL,
+    tail_t INTEGER,
+    tail_v REAL,
     PRIMARY KEY(sid, rid, lvl, bid))"""
 
+SQL_TMPO_HEADER_COLUMNS = (
+    "head_t INTEGER",
+    "head_v REAL",
+    "tail_t INTEGER",
+    "tail_v REAL")
+
+SQL_TMPO_ADD_COLUMN = """
+    ALTER TABLE tmpo
+    ADD COLUMN %s"""
+
+SQL_TMPO_HEAD_IDX = """
+    CREATE INDEX IF NOT EXISTS tmpo_head
+    ON tmpo(sid, head_t)"""
+
+SQL_TMPO_TAIL_IDX = """
+    CREATE INDEX IF NOT EXISTS tmpo_tail
+    ON tmpo(sid, tail_t, tail_v)"""
+
+SQL_TMPO_LAST_IDX = """
+    CREATE INDEX IF NOT EXISTS tmpo_last
+    ON tmpo(sid, created, lvl, rid, bid, ext)"""
+
 SQL_TMPO_INS = """
     INSERT INTO tmpo
-    (sid, rid, lvl, bid, ext, created, data)
-    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+    (sid, rid, lvl, bid, ext, created, data, head_t, head_v, tail_t, tail_v)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+SQL_TMPO_NO_HEADER = """
+    SELECT sid, rid, lvl, bid, ext, created, data
+    FROM tmpo
+    WHERE tail_t IS NULL"""
+
+SQL_TMPO_SET_HEADER = """
+    UPDATE tmpo
+    SET head_t = ?, head_v = ?, tail_t = ?, tail_v = ?
+    WHERE sid = ? AND rid = ? AND lvl = ? AND bid = ?"""
 
 SQL_TMPO_CLEAN = """
     DELETE
     FROM tmpo
     WHERE sid = ? AND rid = ? AND lvl = ? AND bid <= ?"""
 
+SQL_TMPO_CLEANED = """
+    SELECT bid
+    FROM tmpo
+    WHERE sid = ? AND rid = ? AND lvl = ? AND bid <= ?"""
+
+SQL_TMPO_COVER = """
+    SELECT 1
+    FROM tmpo
+    WHERE sid = ? AND rid = ? AND lvl > ? AND bid <= ?
+    AND bid + (1 << lvl) > ?
+    LIMIT 1"""
+
 SQL_TMPO_ALL = """
     SELECT sid, rid, lvl, bid, ext, created, data
     FROM tmpo
     WHERE sid = ?
     ORDER BY rid ASC, lvl DESC, bid ASC"""
 
+SQL_TMPO_EXT = """
+    SELECT sid, rid, lvl, bid, ext, created, data
+    FROM tmpo
+    WHERE sid = ? AND ext = ? AND data IS NOT NULL
+    LIMIT ?"""
+
+SQL_TMPO_SET_DATA = """
+    UPDATE tmpo
+    SET ext = ?, data = ?
+    WHERE sid = ? AND rid = ? AND lvl = ? AND bid = ?"""
+
+SQL_TMPO_RANGE = """
+    SELECT sid, rid, lvl, bid, ext, created, data
+    FROM tmpo
+    WHERE sid = ? AND rid = ? AND bid <= ? AND bid > ?
+    AND bid + (1 << lvl) > ?
+    ORDER BY lvl DESC, bid ASC"""
+
+SQL_TMPO_BLOCKS = """
+    SELECT lvl, bid, created
+    FROM tmpo
+    WHERE sid = ? AND rid = ? AND bid <= ? AND bid > ?
+    AND bid + (1 << lvl) > ?"""
+
+SQL_TMPO_RANGE_IDX = """
+    CREATE INDEX IF NOT EXISTS tmpo_range
+    ON tmpo(sid, rid, bid)"""
+
 SQL_TMPO_LAST = """
     SELECT rid, lvl, bid, ext
     FROM tmpo
@@ -92,17 +172,29 @@ SQL_TMPO_LAST = """
     LIMIT 1"""
 
 SQL_TMPO_LAST_DATA = """
-    SELECT rid, lvl, bid, ext, data
+    SELECT tail_t, tail_v
     FROM tmpo
-    WHERE sid = ?
-    ORDER BY created DESC, lvl DESC
+    WHERE sid = ? AND tail_t IS NOT NULL
+    ORDER BY tail_t DESC
     LIMIT 1"""
 
+SQL_TMPO_LAST_DATA_MANY = """
+    SELECT sid, MAX(tail_t), tail_v
+    FROM tmpo
+    WHERE sid IN (%s) AND tail_t IS NOT NULL
+    GROUP BY sid"""
+
+SQL_TMPO_LAST_DATA_ALL = """
+    SELECT sid, MAX(tail_t), tail_v
+    FROM tmpo
+    WHERE tail_t IS NOT NULL
+    GROUP BY sid"""
+
 SQL_TMPO_FIRST = """
-    SELECT rid, lvl, bid
+    SELECT head_t
     FROM tmpo
-    WHERE sid = ?
-    ORDER BY created ASC, lvl ASC
+    WHERE sid = ? AND head_t IS NOT NULL
+    ORDER BY head_t ASC
     LIMIT 1"""
 
 SQL_TMPO_RID_MAX = """
@@ -110,6 +202,146 @@ SQL_TMPO_RID_MAX = """
     FROM tmpo
     WHERE sid = ?"""
 
+SQL_TMPO_CREATED_MAX = """
+    SELECT MAX(created)
+    FROM tmpo
+    WHERE sid = ? AND rid = ?"""
+
+SQL_TMPO_EXPORT = """
+    SELECT lvl, bid
+    FROM tmpo
+    WHERE sid = ? AND rid = ? AND created > ?
+    AND bid <= ? AND bid + (1 << lvl) > ?"""
+
+SQL_SYNC_TABLE = """
+    CREATE TABLE IF NOT EXISTS tmpo_sync(
+    sid TEXT,
+    owner TEXT,
+    expiry REAL,
+    rid INTEGER,
+    lvl INTEGER,
+    bid INTEGER,
+    synced REAL,
+    PRIMARY KEY(sid))"""
+
+SQL_SYNC_INS = """
+    INSERT OR IGNORE INTO tmpo_sync
+    (sid)
+    VALUES (?)"""
+
+SQL_SYNC_LEASE = """
+    UPDATE tmpo_sync
+    SET owner = ?, expiry = ?
+    WHERE sid = ? AND (owner IS NULL OR expiry < ?)
+    AND (synced IS NULL OR synced < ?)"""
+
+SQL_SYNC_RENEW = """
+    UPDATE tmpo_sync
+    SET expiry = ?
+    WHERE owner = ?"""
+
+SQL_SYNC_DONE = """
+    UPDATE tmpo_sync
+    SET rid = ?, lvl = ?, bid = ?, synced = ?
+    WHERE sid = ? AND owner = ?"""
+
+SQL_SYNC_RELEASE = """
+    UPDATE tmpo_sync
+    SET owner = NULL, expiry = NULL
+    WHERE sid = ? AND owner = ?"""
+
+SQL_SYNC_POS = """
+    SELECT sid, lvl, bid
+    FROM tmpo_sync"""
+
+SQL_SYNC_DEL = """
+    DELETE FROM tmpo_sync
+    WHERE sid = ?"""
+
+SQL_TMPO_COUNT = """
+    SELECT COUNT(*)
+    FROM tmpo
+    WHERE sid = ? AND rid = ?"""
+
+SQL_ARRAY_TABLE = """
+    CREATE TABLE IF NOT EXISTS tmpo_array(
+    sid TEXT,
+    rid INTEGER,
+    n INTEGER,
+    PRIMARY KEY(sid, rid))"""
+
+SQL_ARRAY_VERSION = """
+    ALTER TABLE tmpo_array
+    ADD COLUMN version INTEGER NOT NULL DEFAULT 0"""
+
+SQL_ARRAY_CLEAR = """
+    DELETE FROM tmpo_array"""
+
+SQL_ARRAY_LEN = """
+    SELECT n, version
+    FROM tmpo_array
+    WHERE sid = ? AND rid = ?"""
+
+SQL_ARRAY_SET = """
+    INSERT OR REPLACE INTO tmpo_array
+    (sid, rid, n, version)
+    VALUES (?, ?, ?, ?)"""
+
+SQL_ARRAY_DEL = """
+    DELETE FROM tmpo_array
+    WHERE sid = ?"""
+
+SQL_ROLLUP_TABLE = """
+    CREATE TABLE IF NOT EXISTS tmpo_rollup(
+    sid TEXT,
+    rid INTEGER,
+    lvl INTEGER,
+    bid INTEGER,
+    res INTEGER,
+    ts INTEGER,
+    n INTEGER,
+    vfirst REAL,
+    vlast REAL,
+    vmin REAL,
+    vmax REAL,
+    vsum REAL,
+    PRIMARY KEY(sid, rid, lvl, bid, res, ts))"""
+
+SQL_ROLLUP_IDX = """
+    CREATE INDEX IF NOT EXISTS tmpo_rollup_ts
+    ON tmpo_rollup(sid, rid, res, ts)"""
+
+SQL_ROLLUP_INS = """
+    INSERT OR REPLACE INTO tmpo_rollup
+    (sid, rid, lvl, bid, res, ts, n, vfirst, vlast, vmin, vmax, vsum)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+SQL_ROLLUP_CLEAN = """
+    DELETE
+    FROM tmpo_rollup
+    WHERE sid = ? AND rid = ? AND lvl = ? AND bid <= ?"""
+
+SQL_ROLLUP_DEL = """
+    DELETE FROM tmpo_rollup
+    WHERE sid = ?"""
+
+SQL_ROLLUP_RANGE = """
+    SELECT ts, n, vfirst, vlast, vmin, vmax, vsum
+    FROM tmpo_rollup
+    WHERE sid = ? AND rid = ? AND res = ? AND ts >= ? AND ts < ?
+    ORDER BY ts ASC, bid ASC"""
+
+SQL_ROLLUP_MISSING = """
+    SELECT sid, rid, lvl, bid, ext, created, data
+    FROM tmpo
+    WHERE sid = ? AND rid = ? AND bid <= ? AND bid > ?
+    AND bid + (1 << lvl) > ? AND data IS NOT NULL
+    AND NOT EXISTS (
+        SELECT 1
+        FROM tmpo_rollup AS r
+        WHERE r.sid = tmpo.sid AND r.rid = tmpo.rid
+        AND r.lvl = tmpo.lvl AND r.bid = tmpo.bid)"""
+
 API_TMPO_SYNC = "https://%s/sensor/%s/tmpo/sync"
 API_TMPO_BLOCK = "https://%s/sensor/%s/tmpo/%d/%d/%d"
 
@@ -117,10 +349,38 @@ HTTP_ACCEPT = {
     "json": "application/json",
     "gz": "application/gzip"}
 
-RE_JSON_BLK = r'^\{"h":(?P<h>\{.+?\}),"t":(?P<t>\[.+?\]),"v":(?P<v>\[.+?\])\}$'
 DBG_TMPO_REQUEST = "[r] time:%.3f sid:%s rid:%d lvl:%2d bid:%d"
 DBG_TMPO_WRITE = "[w] time:%.3f sid:%s rid:%d lvl:%2d bid:%d size[B]:%d"
 EPOCHS_MAX = 2147483647
+SQLITE_TIMEOUT = 30  # seconds
+SQLITE_VARIABLES = 500  # bound parameters per statement
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",  # KiB
+    "PRAGMA mmap_size = 268435456")  # bytes
+LVL_MAX = 20
+CACHE_SIZE = 64 * 1024 * 1024  # bytes
+WRITE_BATCH = 64  # rows
+COLUMNAR_LVL = 16  # columnar storage window, 2**lvl seconds
+SERIES_LOCKS = 64  # series cache entries are locked by hash, in stripes
+ROLLUP_RES = (300, 3600, 86400)  # seconds
+BIN_EXT = "bin"
+BIN_VERSION = 1
+BIN_HEADER = "<BBBIqd"  # version, dtypes, count, head sample
+BIN_DTYPES = ("<u1", "<i1", "<u2", "<i2", "<u4", "<i4", "<i8", "<f8")
+ROLLUP_HOW = ("count", "first", "last", "min", "max", "mean", "sum")
+HTTP_TIMEOUT = 60  # seconds
+HTTP_RETRIES = 4
+HTTP_BACKOFF = 0.5  # seconds, doubled on every retry
+HTTP_BACKOFF_MAX = 30  # seconds
+HTTP_LATENCY_SLACK = 2.0  # latency over the fastest seen that backs off
+HTTP_LATENCY_MIN = 0.01  # seconds
+SYNC_LEASE = 300  # seconds
+SYNC_BATCH = 8  # sensors leased at a time, as the sync pipeline has room
+EXPORT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+EXPORT_MANIFEST = "_tmpo_export.json"
+EXPORT_ROWS = 1 << 20  # rows per written batch
 
 
 import os
@@ -129,61 +389,1105 @@ import io
 import math
 import time
 import sqlite3
+import requests
 import requests_futures.sessions
 import concurrent.futures
 import zlib
-import re
+import struct
 import json
+import threading
+import timeit
+import multiprocessing
+import collections
+import shutil
+import random
+import heapq
+import itertools
+import socket
+import uuid
+import weakref
 import numpy as np
 import pandas as pd
+from contextlib import contextmanager
 from functools import wraps
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # columnar storage is optional
+    pa = None
 
 
-def dbcon(func):
-    """Set up connection before executing function, commit and close connection
-    afterwards. Unless a connection already has been created."""
+def transactional(func):
+    """Run the method inside a write transaction, see Session.transaction"""
     @wraps(func)
-    def wrapper(*args, **kwargs):
-        self = args[0]
-        if self.dbcon is None:
-            # set up connection
-            self.dbcon = sqlite3.connect(self.db)
-            self.dbcur = self.dbcon.cursor()
-            self.dbcur.execute(SQL_SENSOR_TABLE)
-            self.dbcur.execute(SQL_TMPO_TABLE)
-
-            # execute function
+    def wrapper(self, *args, **kwargs):
+        with self.transaction():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _decompress_block(blk, ext):
+    if ext != "gz":
+        raise NotImplementedError("Compression type not supported in tmpo")
+    jblk = zlib.decompress(blk, zlib.MAX_WBITS | 16)  # gzip decoding
+    return jblk
+
+
+def _blk2arrays(ext, blk):
+    """Decode a tmpo block into absolute (timestamps, values) arrays. Kept at
+    module level so blocks can be decoded in worker processes."""
+    if ext == BIN_EXT:
+        return _bin2arrays(blk)
+    return _jblk2arrays(_decompress_block(blk, ext))
+
+
+def _jblk2arrays(jblk):
+    head_t, head_v, t, v = _jblk2deltas(jblk)
+    return _npdelta(t, head_t), _npdelta(v, head_v)
+
+
+def _jblk2deltas(jblk):
+    """Head sample and delta encoded timestamps and values of a json block"""
+    it = jblk.find(b',"t":[')
+    iv = jblk.find(b'],"v":[', it)
+    if (not jblk.startswith(b'{"h":') or not jblk.endswith(b']}')
+            or it < 0 or iv < 0):
+        # unexpected layout, fall back to a full json parse
+        data = json.loads(jblk.decode("utf-8"))
+        h, t, v = data["h"], data["t"], data["v"]
+    else:
+        h = json.loads(jblk[5:it].decode("utf-8"))
+        t = jblk[it + 6:iv]
+        v = jblk[iv + 7:-2]
+    return (h["head"][0], h["head"][1], _nparray(t, np.int64),
+            _nparray(v, np.float64))
+
+
+def _bindtype(a):
+    """Code of the narrowest BIN_DTYPES type holding the deltas a exactly"""
+    if a.dtype.kind == "f":
+        if len(a) > 0 and not (np.all(np.isfinite(a)) and np.all(
+                a == np.trunc(a)) and np.all(np.abs(a) < 2 ** 53)):
+            return len(BIN_DTYPES) - 1
+        a = a.astype(np.int64)
+    for code, dtype in enumerate(BIN_DTYPES[:-1]):
+        info = np.iinfo(dtype)
+        if len(a) == 0 or (a.min() >= info.min and a.max() <= info.max):
+            return code
+
+
+def _gz2bin(blk):
+    """Transcode a gzip json block to the bin format, returning the new
+    block and its decoded (timestamps, values) arrays"""
+    head_t, head_v, t, v = _jblk2deltas(_decompress_block(blk, "gz"))
+    tcode, vcode = _bindtype(t), _bindtype(v)
+    body = (t.astype(BIN_DTYPES[tcode]).tobytes() +
+            v.astype(BIN_DTYPES[vcode]).tobytes())
+    header = struct.pack(BIN_HEADER, BIN_VERSION, tcode, vcode, len(t),
+                             int(head_t), float(head_v))
+    return (header + _deflate(body),
+            (_npdelta(t, head_t), _npdelta(v, head_v)))
+
+
+def _deflate(body):
+    """Smallest of a few quick zlib encodings of body. Run length encoding
+    suits noisy deltas, on which deeper string matching is slow and gains
+    little. String matching wins on repetitive deltas, and is fast there."""
+    def compress(level, strategy):
+        z = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9, strategy)
+        return z.compress(body) + z.flush()
+    rle = compress(6, zlib.Z_RLE)
+    lz = compress(1, zlib.Z_DEFAULT_STRATEGY)
+    if 2 * len(lz) < len(rle):
+        lz = compress(6, zlib.Z_DEFAULT_STRATEGY)
+    return min(rle, lz, key=len)
+
+
+def _bin2arrays(blk):
+    """Decode a bin block: a BIN_HEADER followed by the zlib compressed
+    timestamp and value deltas, each as a little endian array of the
+    narrowest type that holds them"""
+    version, tcode, vcode, n, head_t, head_v = struct.unpack_from(
+        BIN_HEADER, blk)
+    if version != BIN_VERSION:
+        raise NotImplementedError("Block version not supported in tmpo")
+    raw = zlib.decompress(memoryview(blk)[struct.calcsize(BIN_HEADER):])
+    tdtype, vdtype = np.dtype(BIN_DTYPES[tcode]), np.dtype(BIN_DTYPES[vcode])
+    t = np.frombuffer(raw, tdtype, n)
+    v = np.frombuffer(raw, vdtype, n, n * tdtype.itemsize)
+    t = np.cumsum(t, dtype=np.int64)
+    t += head_t
+    return t, _npdelta(v.astype(np.float64), head_v)
+
+
+def _nparray(a, dtype):
+    """Array of a list, or of the body of a json array of numbers. Nulls
+    take a json parse and become NaN, or raise for an integer dtype."""
+    if not isinstance(a, bytes):
+        return np.asarray(a, dtype=dtype)
+    if a.strip() == b"":
+        return np.empty(0, dtype=dtype)
+    if b"null" in a:
+        return np.array(json.loads(b"[" + a + b"]"), dtype=dtype)
+    return np.array(a.split(b","), dtype=dtype)
+
+
+def _npdelta(a, delta):
+    """Rebuild absolute values from a delta encoded array, summing
+    sequentially starting from delta"""
+    if len(a) == 0:
+        return a
+    return np.cumsum(np.concatenate(([delta], a)), dtype=a.dtype)[1:]
+
+
+def _rollup(t, v, res):
+    """Aggregate samples into buckets of res seconds, returning the bucket
+    timestamps and their count, first, last, min, max and sum"""
+    ts = t // res * res
+    ts, idx = np.unique(ts, return_index=True)
+    if len(ts) == 0:
+        return (ts,) + (np.empty(0),) * 6
+    n = np.diff(np.append(idx, len(t)))
+    return (ts, n, v[idx], v[idx + n - 1], np.minimum.reduceat(v, idx),
+            np.maximum.reduceat(v, idx), np.add.reduceat(v, idx))
+
+
+def _backoff(attempt):
+    """Seconds to wait before retry number attempt + 1, exponential with
+    jitter so failed clients do not retry in lockstep"""
+    delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _retryable(e):
+    """Whether a failed request is worth retrying: connection problems,
+    timeouts, throttling and server errors"""
+    if isinstance(e, requests.exceptions.HTTPError):
+        status = e.response.status_code if e.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(e, (requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout))
+
+
+def _months(head, tail):
+    """Epochs of the first second of the UTC months overlapping [head, tail]
+    """
+    first, last = (np.datetime64(int(x), "s").astype("datetime64[M]")
+                   for x in (head, tail))
+    months = np.arange(first, last + 1).astype("datetime64[s]")
+    return [int(m) for m in months.astype(np.int64)]
+
+
+def _export_partition(home, storage, *args):
+    """Session._export_partition in a fresh session, so partitions can be
+    exported in worker processes"""
+    session = Session(os.path.dirname(home), cache_size=0, storage=storage)
+    try:
+        return session._export_partition(*args)
+    finally:
+        session.close()
+
+
+def _truncate(t, v, head, tail):
+    """Slice sorted timestamps to [head, tail] with a binary search"""
+    i = np.searchsorted(t, head, side="left")
+    j = np.searchsorted(t, tail, side="right")
+    return t[i:j], v[i:j]
+
+
+def _same(a, b, dtype):
+    """Whether two arrays hold the same bytes as dtype, NaN included"""
+    return (np.ascontiguousarray(a, dtype=dtype).tobytes() ==
+            np.ascontiguousarray(b, dtype=dtype).tobytes())
+
+
+def _close_reader(readers, lock, con):
+    """Close the reader connection of a thread that exited"""
+    with lock:
+        readers.discard(con)
+    con.close()
+
+
+class _NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics():
+    """
+    Instrumentation hooks called on the hot paths of a Session. All methods
+    are no-ops, subclass to forward timings and counters elsewhere.
+
+    Timers: http.sync, http.block, decode.bin, decode.decompress,
+    decode.parse, decode.pool, db.encode, db.write, db.rollup, db.clean,
+    series.concat, series.patch, columnar.read, mmap.read
+    Counters: http.bytes, http.retry, cache.hit, cache.miss, series.hit,
+    series.miss, series.patch
+    """
+    def timer(self, name):
+        """Context manager timing the enclosed block"""
+        return _NULL_TIMER
+
+    def timing(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+
+class _Timer():
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.timing(self.name, timeit.default_timer() - self.start)
+        return False
+
+
+class MemoryMetrics(Metrics):
+    def __init__(self):
+        """
+        Metrics collector keeping all timings and counters in memory, to
+        summarize a sync or query run
+
+            >>> s = tmpo.Session(metrics=tmpo.MemoryMetrics())
+            >>> s.sync()
+            >>> s.metrics.summary()
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def timing(self, name, seconds):
+        with self._lock:
+            self.timings[name].append(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    def reset(self):
+        with self._lock:
+            self.timings = collections.defaultdict(list)
+            self.counts = collections.defaultdict(int)
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict
+            per timer its count, total, mean, min, p50, p95 and max in
+            seconds, and the value of each counter
+        """
+        with self._lock:
+            timings = dict((k, np.array(v)) for k, v in self.timings.items())
+            summary = dict(self.counts)
+        for name, a in timings.items():
+            summary[name] = {
+                "count": len(a),
+                "total": float(a.sum()),
+                "mean": float(a.mean()),
+                "min": float(a.min()),
+                "p50": float(np.percentile(a, 50)),
+                "p95": float(np.percentile(a, 95)),
+                "max": float(a.max())}
+        return summary
+
+
+class _Concurrency():
+    def __init__(self, limit, maximum):
+        """
+        Adaptive limit on outstanding requests. It grows by about one per
+        round trip while latency stays within HTTP_LATENCY_SLACK times the
+        fastest seen, shrinks as slowly beyond that, and halves on failed
+        requests, at most once per round trip.
+
+        Parameters
+        ----------
+        limit : int
+            initial limit
+        maximum : int
+        """
+        self.limit = float(min(limit, maximum))
+        self.maximum = maximum
+        self.fastest = None
+        self.latency = None
+        self._cut = 0
+
+    def success(self, latency):
+        if self.fastest is None or latency < self.fastest:
+            self.fastest = latency
+        if self.latency is None:
+            self.latency = latency
+        self.latency = 0.9 * self.latency + 0.1 * latency
+        base = max(self.fastest, HTTP_LATENCY_MIN)
+        if self.latency <= HTTP_LATENCY_SLACK * base:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        else:
+            self.limit = max(1.0, self.limit - 1.0 / self.limit)
+
+    def failure(self):
+        now = time.time()
+        if now < self._cut + (self.latency or 0):
+            return
+        self.limit = max(1.0, self.limit / 2)
+        self._cut = now
+
+
+class BlockCache():
+    def __init__(self, size=CACHE_SIZE):
+        """
+        LRU cache of decoded tmpo blocks, bounded by the number of bytes held
+        in the timestamp and value arrays
+
+        Parameters
+        ----------
+        size : int
+            byte budget, 0 disables caching
+        """
+        self.size = size
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._blocks = collections.OrderedDict()
+        self._sids = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Parameters
+        ----------
+        key : tuple
+            (sid, rid, lvl, bid, created)
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray) | None
+        """
+        with self._lock:
             try:
-                result = func(*args, **kwargs)
-            except Exception as e:
-                # on exception, first close connection and then raise
-                self.dbcon.rollback()
-                self.dbcon.commit()
-                self.dbcon.close()
-                self.dbcon = None
-                self.dbcur = None
-                raise e
-            else:
-                # commit everything and close connection
-                self.dbcon.commit()
-                self.dbcon.close()
-                self.dbcon = None
-                self.dbcur = None
+                arrays = self._blocks.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._blocks[key] = arrays
+            self.hits += 1
+            return arrays
+
+    def put(self, key, arrays):
+        nbytes = sum(a.nbytes for a in arrays)
+        if nbytes > self.size:
+            return
+        with self._lock:
+            if key in self._blocks:
+                self._discard(key)
+            while self.nbytes + nbytes > self.size:
+                self._discard(next(iter(self._blocks)))
+                self.evictions += 1
+            self._blocks[key] = arrays
+            self._sids.setdefault(key[0], set()).add(key)
+            self.nbytes += nbytes
+
+    def invalidate(self, sid):
+        """Drop all cached blocks of a sensor"""
+        with self._lock:
+            for key in list(self._sids.get(sid, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._sids.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "blocks": len(self._blocks),
+            "nbytes": self.nbytes,
+            "size": self.size}
+
+    def _discard(self, key):
+        arrays = self._blocks.pop(key)
+        self.nbytes -= sum(a.nbytes for a in arrays)
+        keys = self._sids[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._sids[key[0]]
+
+
+class _Series():
+    def __init__(self, lo, hi):
+        """
+        Samples of a sensor recycle id in [lo, hi], in buffers with room to
+        append, and the (lvl, bid): created of the blocks they were read from
+        """
+        self.lo = lo
+        self.hi = hi
+        self.n = 0
+        self.t = np.empty(0, dtype=np.int64)
+        self.v = np.empty(0)
+        self.blocks = {}
+
+    @property
+    def nbytes(self):
+        return self.t.nbytes + self.v.nbytes
+
+    def slice(self, head, tail):
+        """Read-only views of the samples in [head, tail]"""
+        t = self.t[:self.n]
+        i = np.searchsorted(t, head, side="left")
+        j = np.searchsorted(t, tail, side="right")
+        arrays = (self.t[i:j], self.v[i:j])
+        for a in arrays:
+            a.flags.writeable = False
+        return arrays
+
+    def splice(self, head, tail, st, sv):
+        """Replace the samples in [head, tail] by st, sv. Samples after the
+        last one are appended in place, anything else copies the buffers, so
+        views handed out by slice() never change."""
+        n, k = self.n, len(st)
+        i = np.searchsorted(self.t[:n], head, side="left")
+        j = np.searchsorted(self.t[:n], tail, side="right")
+        size = n - (j - i) + k
+        if i == n and size <= len(self.t):
+            self.t[n:size] = st
+            self.v[n:size] = sv
         else:
-            result = func(*args, **kwargs)
-        return result
-    return wrapper
+            t = np.empty(size + size // 4, dtype=np.int64)
+            v = np.empty(len(t))
+            t[:i], v[:i] = self.t[:i], self.v[:i]
+            t[i:i + k], v[i:i + k] = st, sv
+            t[i + k:size], v[i + k:size] = self.t[j:n], self.v[j:n]
+            self.t, self.v = t, v
+        self.n = size
+
+
+class SeriesCache():
+    def __init__(self, size=0):
+        """
+        LRU cache of assembled series, one timestamp and value array per
+        sensor and recycle id over the interval queried so far, bounded by
+        the number of bytes held. Entries are brought up to date on each
+        query by reloading only the blocks that were written or cleaned
+        since they were read, see Session.series.
+
+        Parameters
+        ----------
+        size : int
+            byte budget, 0 disables caching
+        """
+        self.size = size
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.patches = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Parameters
+        ----------
+        key : tuple
+            (sid, rid)
+
+        Returns
+        -------
+        _Series | None
+        """
+        with self._lock:
+            try:
+                entry, nbytes = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = (entry, nbytes)
+            return entry
+
+    def count(self, hits=0, patches=0):
+        with self._lock:
+            self.hits += hits
+            self.patches += patches
+
+    def put(self, key, entry):
+        """Store an entry, or account for its new size"""
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            if entry.nbytes > self.size:
+                return
+            while self.nbytes + entry.nbytes > self.size:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (entry, entry.nbytes)
+            self.nbytes += entry.nbytes
+
+    def invalidate(self, sid):
+        """Drop all cached series of a sensor"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == sid]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "patches": self.patches,
+            "evictions": self.evictions,
+            "series": len(self._entries),
+            "nbytes": self.nbytes,
+            "size": self.size}
+
+    def _discard(self, key):
+        entry, nbytes = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+
+class Storage():
+    def __init__(self, session):
+        """
+        Block storage of a Session. Blocks arrive in put() as (sid, rid, lvl,
+        bid, ext, created, data) rows with their decoded arrays, and come back
+        from range() as (timestamps, values) arrays, in time order, that
+        callers truncate to the interval themselves. Writes run inside the
+        session's write transaction.
+
+        Parameters
+        ----------
+        session : Session
+        """
+        self.session = session
+
+    def put(self, rows, arrays):
+        raise NotImplementedError
+
+    def list(self, sid):
+        """(sid, rid, lvl, bid, ext, created, data) rows of a sensor"""
+        raise NotImplementedError
+
+    def range(self, sid, rid, head, tail):
+        """Arrays of a sensor recycle id overlapping [head, tail]"""
+        raise NotImplementedError
+
+    def ranges(self, queries):
+        """range() of many (sid, rid, head, tail) queries"""
+        return [self.range(*query) for query in queries]
+
+    def iter_range(self, sid, rid, head, tail):
+        """range() as a generator"""
+        for arrays in self.range(sid, rid, head, tail):
+            yield arrays
+
+    def clean(self, cleans):
+        """Drop the blocks up to bid of each (sid, rid, lvl, bid), at lvl"""
+        raise NotImplementedError
+
+    def blocks(self, sid, rid, head, tail):
+        """(lvl, bid, created) of the blocks of a sensor recycle id
+        overlapping [head, tail], used by the series cache"""
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+
+class SQLiteStorage(Storage):
+    """Compressed tmpo blocks in the tmpo table, decoded on read"""
+
+    def put(self, rows, arrays):
+        self.session.dbcur.executemany(SQL_TMPO_INS, [
+            row + self.session._header(t, v)
+            for row, (t, v) in zip(rows, arrays)])
+
+    def list(self, sid):
+        return self.session.dbcur.execute(SQL_TMPO_ALL, (sid,)).fetchall()
+
+    def range(self, sid, rid, head, tail):
+        return self.session._decode(self._rows(sid, rid, head, tail))
+
+    def ranges(self, queries):
+        # decode the blocks of all queries in one go
+        blocks = [self._rows(*query) for query in queries]
+        arrays = self.session._decode([row for rows in blocks for row in rows])
+        ranges = []
+        i = 0
+        for rows in blocks:
+            ranges.append(arrays[i:i + len(rows)])
+            i += len(rows)
+        return ranges
+
+    def iter_range(self, sid, rid, head, tail):
+        # stream rows on a connection of our own, to not hold them all
+        session = self.session
+        con = session._connect()
+        try:
+            cur = con.cursor()
+            cur.execute(SQL_TMPO_RANGE, (
+                sid, rid, tail, session._blockhead(LVL_MAX, head), head))
+            for sid, rid, lvl, bid, ext, ctd, blk in cur:
+                yield (session.cache.get((sid, rid, lvl, bid, ctd))
+                       or _blk2arrays(ext, blk))
+        finally:
+            con.close()
+
+    def clean(self, cleans):
+        self.session.dbcur.executemany(SQL_TMPO_CLEAN, cleans)
+
+    def blocks(self, sid, rid, head, tail):
+        return self.session.dbcur.execute(SQL_TMPO_BLOCKS, (
+            sid, rid, tail, self.session._blockhead(LVL_MAX, head),
+            head)).fetchall()
+
+    def delete(self, sid):
+        self.session.dbcur.execute(SQL_TMPO_DEL, (sid,))
+
+    def _uncovered(self, cleans):
+        """(sid, rid, lvl, bid, t, v) blocks, with empty arrays, for the
+        blocks that clean() will drop and no remaining block covers"""
+        cur = self.session.dbcur
+        empty = (np.empty(0, dtype=np.int64), np.empty(0))
+        blocks = []
+        for sid, rid, lvl, bid in cleans:
+            for (b,) in cur.execute(
+                    SQL_TMPO_CLEANED, (sid, rid, lvl, bid)).fetchall():
+                cur.execute(SQL_TMPO_COVER, (sid, rid, lvl, b, b))
+                if cur.fetchone() is None:
+                    blocks.append((sid, rid, lvl, b) + empty)
+        return blocks
+
+    def _rows(self, sid, rid, head, tail):
+        return self.session.dbcur.execute(SQL_TMPO_RANGE, (
+            sid, rid, tail, self.session._blockhead(LVL_MAX, head),
+            head)).fetchall()
+
+
+class ColumnarStorage(SQLiteStorage):
+    def __init__(self, session):
+        """
+        Decoded samples in Arrow IPC files, one per sensor, recycle id and
+        window of 2**COLUMNAR_LVL seconds, under <home>/columnar. Reads memory
+        map the files, so they skip decompression and parsing and copy
+        nothing. The tmpo table keeps the block rows, without their data, for
+        sync, rollups and the first/last lookups.
+
+        A block replaces the samples of its time span in the windows it
+        covers, which also drops the samples of the children it supersedes.
+        Cleaned blocks that no remaining block covers lose their samples too.
+        Rewritten windows are staged under <home>/columnar/.staged and
+        swapped in atomically once the transaction commits, a rollback drops
+        them. Removed sensors keep their files until the commit as well.
+
+        Requires pyarrow.
+
+        Parameters
+        ----------
+        session : Session
+        """
+        if pa is None:
+            raise ImportError("Columnar storage requires pyarrow")
+        Storage.__init__(self, session)
+        self.root = os.path.join(session.home, "columnar")
+        self.staging = os.path.join(self.root, ".staged")
+        self._staged = {}  # window path: staged path, None to remove
+        self._deleted = set()  # sensors to remove before the swaps
+
+    def put(self, rows, arrays):
+        self.session.dbcur.executemany(SQL_TMPO_INS, [
+            row[:6] + (None,) + self.session._header(t, v)
+            for row, (t, v) in zip(rows, arrays)])
+        self._write([row[:4] + a for row, a in zip(rows, arrays)])
+
+    def clean(self, cleans):
+        blocks = self._uncovered(cleans)
+        SQLiteStorage.clean(self, cleans)
+        self._write(blocks)
+
+    def range(self, sid, rid, head, tail):
+        if rid is None:
+            return []
+        window = 1 << COLUMNAR_LVL
+        with self.session.metrics.timer("columnar.read"):
+            return [self._read(sid, rid, w) for w in self._windows(sid, rid)
+                    if w + window > head and w <= tail]
+
+    def ranges(self, queries):
+        return Storage.ranges(self, queries)
+
+    def iter_range(self, sid, rid, head, tail):
+        if rid is None:
+            return
+        window = 1 << COLUMNAR_LVL
+        for w in self._windows(sid, rid):
+            if w + window > head and w <= tail:
+                try:
+                    arrays = self._read(sid, rid, w)
+                except OSError:  # removed since the listing
+                    continue
+                yield arrays
+
+    def delete(self, sid):
+        SQLiteStorage.delete(self, sid)
+        directory = os.path.join(self.root, sid, "")
+        for path in [p for p in self._staged if p.startswith(directory)]:
+            source = self._staged.pop(path)
+            if source is not None and os.path.exists(source):
+                os.remove(source)
+        self._stage(sid=sid)
+
+    def _path(self, sid, rid, w):
+        return os.path.join(self.root, sid, str(rid), "%d.arrow" % w)
+
+    def _windows(self, sid, rid):
+        try:
+            names = os.listdir(os.path.join(self.root, sid, str(rid)))
+        except OSError:  # nothing stored
+            return []
+        return sorted(int(name[:-6]) for name in names
+                      if name.endswith(".arrow"))
+
+    def _read(self, sid, rid, w, path=None):
+        if path is None:
+            path = self._path(sid, rid, w)
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        return (table.column("t").chunk(0).to_numpy(),
+                table.column("v").chunk(0).to_numpy())
+
+    def _write(self, blocks):
+        """Store the (sid, rid, lvl, bid, t, v) blocks, window by window"""
+        window = 1 << COLUMNAR_LVL
+        spans = collections.OrderedDict()
+        for sid, rid, lvl, bid, t, v in blocks:
+            end = bid + (1 << lvl)
+            for w in range(bid - bid % window, end, window):
+                head, tail = max(bid, w), min(end, w + window) - 1
+                spans.setdefault((sid, rid, w), []).append(
+                    (head, tail) + _truncate(t, v, head, tail))
+        for (sid, rid, w), wspans in spans.items():
+            self._patch(sid, rid, w, wspans)
+
+    def _patch(self, sid, rid, w, spans):
+        """Replace the samples of window w in each (head, tail, t, v) span,
+        in order, and stage the result"""
+        path = self._path(sid, rid, w)
+        # files of a sensor removed in this transaction are gone already
+        source = self._staged.get(path, None if sid in self._deleted else path)
+        if source is not None and os.path.exists(source):
+            t, v = self._read(sid, rid, w, source)
+        else:
+            t, v = np.empty(0, dtype=np.int64), np.empty(0)
+        for head, tail, st, sv in spans:
+            i = np.searchsorted(t, head, side="left")
+            j = np.searchsorted(t, tail, side="right")
+            t = np.concatenate((t[:i], st, t[j:])).astype(np.int64)
+            v = np.concatenate((v[:i], sv, v[j:])).astype(np.float64)
+        staged = os.path.join(self.staging, sid, str(rid), "%d.arrow" % w)
+        if len(t) == 0:
+            self._stage(path, None)
+            return
+        table = pa.table({"t": t, "v": v})
+        try:
+            os.makedirs(os.path.dirname(staged))
+        except OSError:  # dir exists
+            pass
+        with pa.OSFile(staged, "wb") as f:
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table, max_chunksize=len(t))
+        self._stage(path, staged)
+
+    def _stage(self, path=None, staged=None, sid=None):
+        """Swap a staged file, or nothing to remove it, in at path, or remove
+        the files of a sensor, once the transaction commits"""
+        first = not self._staged and not self._deleted
+        if sid is None:
+            self._staged[path] = staged
+        else:
+            self._deleted.add(sid)
+        if first:
+            self.session._after_rollback(self._unstage)
+            self.session._after_commit(self._commit)
+
+    def _commit(self):
+        staged, self._staged = self._staged, {}
+        deleted, self._deleted = self._deleted, set()
+        for sid in deleted:
+            shutil.rmtree(os.path.join(self.root, sid), ignore_errors=True)
+        for path, source in staged.items():
+            if source is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:  # dir exists
+                pass
+            os.replace(source, path)
+
+    def _unstage(self):
+        staged, self._staged = self._staged, {}
+        self._deleted = set()
+        for source in staged.values():
+            if source is not None and os.path.exists(source):
+                os.remove(source)
+
+
+class MmapStorage(SQLiteStorage):
+    def __init__(self, session):
+        """
+        Compressed blocks in the tmpo table as with SQLiteStorage, plus one
+        contiguous timestamp and value array per sensor and recycle id, in
+        <home>/arrays/<sid>/<rid>.<version>.t and .v as raw little endian
+        int64 and float64. Reads memory map the arrays and slice them after
+        two binary searches, without copying, so cold queries cost page
+        faults instead of decompression.
+
+        The tmpo_array table holds the version and number of valid samples
+        of each array, and changes in the transaction that writes the
+        blocks. Samples a reader or a rollback may still need are never
+        overwritten: a block at the end of an array, the common case, only
+        appends past the valid samples when the ones it shares with the
+        array are unchanged. Other blocks write a new version of the array,
+        and the previous one is removed once the transaction commits.
+        Arrays missing for blocks already in the database, or whose files
+        do not hold their record, are built from the blocks on first use.
+
+        Parameters
+        ----------
+        session : Session
+        """
+        Storage.__init__(self, session)
+        self.root = os.path.join(session.home, "arrays")
+
+    def put(self, rows, arrays):
+        SQLiteStorage.put(self, rows, arrays)
+        self._write([row[:4] + a for row, a in zip(rows, arrays)])
+
+    def clean(self, cleans):
+        blocks = self._uncovered(cleans)
+        SQLiteStorage.clean(self, cleans)
+        self._write(blocks)
+
+    def range(self, sid, rid, head, tail):
+        if rid is None:
+            return []
+        t, v = self._arrays(sid, rid)
+        if len(t) == 0:
+            return []
+        with self.session.metrics.timer("mmap.read"):
+            i = np.searchsorted(t, head, side="left")
+            j = np.searchsorted(t, tail, side="right")
+            return [(t[i:j], v[i:j])]
+
+    def ranges(self, queries):
+        return Storage.ranges(self, queries)
+
+    def iter_range(self, sid, rid, head, tail):
+        return Storage.iter_range(self, sid, rid, head, tail)
+
+    def delete(self, sid):
+        SQLiteStorage.delete(self, sid)
+        self.session.dbcur.execute(SQL_ARRAY_DEL, (sid,))
+        directory = os.path.join(self.root, sid)
+        self.session._after_commit(
+            lambda: shutil.rmtree(directory, ignore_errors=True))
+
+    def _path(self, sid, rid, version, ext):
+        return os.path.join(self.root, sid, "%d.%d.%s" % (rid, version, ext))
+
+    def _array(self, sid, rid):
+        """(n, version) of the arrays of a sensor recycle id, or None"""
+        self.session.dbcur.execute(SQL_ARRAY_LEN, (sid, rid))
+        return self.session.dbcur.fetchone()
+
+    def _arrays(self, sid, rid):
+        """Mapped arrays of a sensor recycle id, built first when needed"""
+        arrays = self._map(sid, rid, self._array(sid, rid))
+        if arrays is None:
+            with self.session.transaction():
+                array = self._array(sid, rid)
+                arrays = self._map(sid, rid, array)
+                if arrays is None:
+                    arrays = self._map(sid, rid, self._build(sid, rid, array))
+        return arrays
+
+    def _map(self, sid, rid, array):
+        """Memory map the valid samples of an (n, version) array, None when
+        there is no array or its files are missing or short"""
+        if array is None:
+            return None
+        n, version = array
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        try:
+            return tuple(
+                np.memmap(self._path(sid, rid, version, ext), dtype=dtype,
+                          mode="r", shape=(n,)).view(np.ndarray)
+                for ext, dtype in (("t", "<i8"), ("v", "<f8")))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _build(self, sid, rid, array):
+        """Write a new version of the arrays of a sensor recycle id from its
+        blocks, returning its (n, version)"""
+        arrays = SQLiteStorage.range(self, sid, rid, 0, EPOCHS_MAX)
+        if arrays:
+            t, v = (np.concatenate(a) for a in zip(*arrays))
+        else:
+            t, v = np.empty(0, dtype=np.int64), np.empty(0)
+        version = 0 if array is None else array[1] + 1
+        return self._save(sid, rid, version, t, v, 0)
+
+    def _write(self, blocks):
+        """Store the (sid, rid, lvl, bid, t, v) blocks, replacing the samples
+        in the time span of each block"""
+        spans = collections.OrderedDict()
+        for sid, rid, lvl, bid, t, v in blocks:
+            tail = bid + (1 << lvl) - 1
+            spans.setdefault((sid, rid), []).append(
+                (bid, tail) + _truncate(t, v, bid, tail))
+        for (sid, rid), kspans in spans.items():
+            array = self._array(sid, rid)
+            if array is None:
+                self.session.dbcur.execute(SQL_TMPO_COUNT, (sid, rid))
+                if self.session.dbcur.fetchone()[0] > len(kspans):
+                    # older blocks without arrays, the build includes ours
+                    self._build(sid, rid, None)
+                    continue
+                array = (0, 0)
+            elif self._map(sid, rid, array) is None:
+                # lost files, the build includes our blocks
+                self._build(sid, rid, array)
+                continue
+            for head, tail, st, sv in kspans:
+                array = self._patch(sid, rid, array, head, tail, st, sv)
+
+    def _patch(self, sid, rid, array, head, tail, st, sv):
+        """Replace the samples in [head, tail] of an (n, version) array,
+        returning its new (n, version)"""
+        n, version = array
+        t, v = self._map(sid, rid, array)
+        i = np.searchsorted(t, head, side="left")
+        j = np.searchsorted(t, tail, side="right")
+        k = n - i  # samples of the span in the array
+        if (j == n and len(st) >= k and _same(t[i:], st[:k], "<i8") and
+                _same(v[i:], sv[:k], "<f8")):
+            return self._save(sid, rid, version, st[k:], sv[k:], n)
+        t = np.concatenate((t[:i], st, t[j:]))
+        v = np.concatenate((v[:i], sv, v[j:]))
+        return self._save(sid, rid, version + 1, t, v, 0)
+
+    def _save(self, sid, rid, version, t, v, offset):
+        """Write t and v to a version of the arrays from sample offset on,
+        and record it with its length. Offset 0 starts a new version, others
+        append to the recorded one."""
+        directory = os.path.join(self.root, sid)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for ext, a, dtype in (("t", t, "<i8"), ("v", v, "<f8")):
+            # files only grow, to not pull pages from under readers
+            with io.open(self._path(sid, rid, version, ext),
+                         "r+b" if offset else "wb") as f:
+                f.seek(offset * 8)
+                f.write(np.ascontiguousarray(a, dtype=dtype).tobytes())
+        previous = self._array(sid, rid)
+        if previous is not None and previous[1] != version:
+            self.session._after_commit(
+                lambda: self._remove(sid, rid, previous[1]))
+        n = int(offset) + len(t)
+        self.session.dbcur.execute(SQL_ARRAY_SET, (sid, rid, n, version))
+        return n, version
+
+    def _remove(self, sid, rid, version):
+        for ext in ("t", "v"):
+            try:
+                os.remove(self._path(sid, rid, version, ext))
+            except OSError:  # already gone, or mapped on windows
+                pass
 
 
 class Session():
-    def __init__(self, path=None, workers=16):
+    def __init__(self, path=None, workers=16, cache_size=CACHE_SIZE,
+                 inflight=None, decoder=None, decoder_workers=None,
+                 metrics=None, storage="sqlite", pool_size=None,
+                 codec=BIN_EXT, series_cache=0):
         """
         Parameters
         ----------
         path : str, optional
             location for the database
         workers : int
+            number of outstanding requests a sync starts with
             default 16
+        cache_size : int
+            byte budget of the decoded block cache, 0 disables it
+            default 64 MiB
+        inflight : int, optional
+            maximum number of outstanding requests during sync, which
+            adapts to latency and errors up to this value, each on its own
+            thread
+            default 4 * workers
+        decoder : str, optional
+            "thread" or "process" to decode blocks in parallel in series()
+            and dataframe()
+            default None, decode in the calling thread
+        decoder_workers : int, optional
+            size of the decoder pool
+            default number of CPUs
+        metrics : Metrics, optional
+            instrumentation hooks, e.g. a MemoryMetrics collector
+            default no-op
+        storage : str | type, optional
+            "sqlite" to keep compressed blocks in the database, "columnar"
+            for decoded samples in Arrow files (requires pyarrow), "mmap"
+            to add memory mapped arrays per sensor, or a Storage subclass
+            default "sqlite"
+        pool_size : int, optional
+            number of kept-alive connections to the API
+            default inflight
+        codec : str
+            "bin" to store synced blocks in a compact binary format, or
+            "gz" to store them as served, in gzip json. Bin blocks decode
+            about 3 times faster at lvl 8 and 8 to 15 times faster at lvl
+            12 and up, see benchmarks/decode.py
+            default "bin"
+        series_cache : int
+            byte budget of the series cache, which keeps the assembled
+            arrays of series() and dataframe() queries and only reloads
+            blocks written since, 0 disables it
+            default 0
         """
         self.debug = False
         if path is None:
@@ -202,14 +1506,230 @@ class Session():
         else:
             with io.open(self.crt, "wb") as f:
                 f.write(FLUKSO_CRT.encode("ascii"))
+        if inflight is None:
+            inflight = 4 * workers
+        self.inflight = inflight
+        self.concurrency = _Concurrency(workers, inflight)
+        # a thread per outstanding request, so none waits in the executor
+        # queue where r.elapsed would not see it
         self.rqs = requests_futures.sessions.FuturesSession(
             executor=concurrent.futures.ThreadPoolExecutor(
-                max_workers=workers))
+                max_workers=inflight))
         self.rqs.headers.update({"X-Version": "1.0"})
-        self.dbcon = None
-        self.dbcur = None
-
-    @dbcon
+        if pool_size is None:
+            pool_size = inflight
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.rqs.mount("https://", adapter)
+        self.rqs.mount("http://", adapter)
+        self._writer = None
+        self._wlock = threading.RLock()
+        self._readers = set()
+        self._rlock = threading.Lock()
+        self._local = threading.local()
+        self.owner = "%s:%d:%s" % (
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._renewed = 0
+        self.cache = BlockCache(cache_size)
+        self.series_cache = SeriesCache(series_cache)
+        self._slocks = [threading.Lock() for i in range(SERIES_LOCKS)]
+        self.metrics = Metrics() if metrics is None else metrics
+        if decoder_workers is None:
+            decoder_workers = multiprocessing.cpu_count()
+        if decoder is None:
+            self.decoder = None
+        elif decoder == "thread":
+            self.decoder = concurrent.futures.ThreadPoolExecutor(
+                max_workers=decoder_workers)
+        elif decoder == "process":
+            self.decoder = concurrent.futures.ProcessPoolExecutor(
+                max_workers=decoder_workers)
+        else:
+            raise ValueError("Decoder not supported. " +
+                             "Use None, 'thread' or 'process'.")
+        if codec not in (BIN_EXT, "gz"):
+            raise ValueError("Codec not supported. Use 'bin' or 'gz'.")
+        self.codec = codec
+        if storage == "sqlite":
+            self.storage = SQLiteStorage(self)
+        elif storage == "columnar":
+            self.storage = ColumnarStorage(self)
+        elif storage == "mmap":
+            self.storage = MmapStorage(self)
+        elif isinstance(storage, type) and issubclass(storage, Storage):
+            self.storage = storage(self)
+        else:
+            raise ValueError("Storage not supported. Use 'sqlite', " +
+                             "'columnar', 'mmap' or a Storage subclass.")
+
+    @property
+    def dbcur(self):
+        """Cursor of the running write transaction of this thread, or else of
+        the thread's own autocommit reader connection, closed when the
+        thread exits"""
+        local = self._local
+        cur = getattr(local, "writer", None)
+        if cur is not None:
+            return cur
+        cur = getattr(local, "reader", None)
+        if cur is None:
+            con = self._connect()
+            con.isolation_level = None
+            with self._rlock:
+                self._readers.add(con)
+            cur = local.reader = con.cursor()
+            # the thread-local cursor goes when the thread does
+            weakref.finalize(
+                cur, _close_reader, self._readers, self._rlock, con)
+        return cur
+
+    @contextmanager
+    def transaction(self):
+        """
+        Scope a write transaction on the session's writer connection. It is
+        committed when the block exits, or rolled back on an exception.
+        Nested transactions join the outer one. Readers in other threads keep
+        reading the last committed state meanwhile. The database write lock
+        is taken up front, so transactions of other processes wait for each
+        other instead of failing on a stale read.
+
+            >>> with s.transaction():
+            ...     s.add(sid, token)
+            ...     s.reset(sid)
+        """
+        with self._wlock:
+            local = self._local
+            if getattr(local, "writer", None) is not None:
+                yield local.writer
+                return
+            if self._writer is None:
+                self._writer = self._connect()
+            local.writer = self._writer.cursor()
+            hooks = local.hooks = []
+            undo = local.undo = []
+            try:
+                local.writer.execute("BEGIN IMMEDIATE")
+                yield local.writer
+            except BaseException:
+                self._writer.rollback()
+                for func in undo:
+                    func()
+                raise
+            else:
+                self._writer.commit()
+            finally:
+                local.writer = None
+                local.hooks = None
+                local.undo = None
+        for func in hooks:
+            func()
+
+    def _after_commit(self, func):
+        """Call func once the write transaction of this thread commits, or
+        right away outside of one. Nothing is called on a rollback."""
+        hooks = getattr(self._local, "hooks", None)
+        if hooks is None:
+            func()
+        else:
+            hooks.append(func)
+
+    def _after_rollback(self, func):
+        """Call func if the write transaction of this thread rolls back.
+        Nothing is called outside of one."""
+        undo = getattr(self._local, "undo", None)
+        if undo is not None:
+            undo.append(func)
+
+    def close(self):
+        """Close all database connections of the session and shut down its
+        request and decoder pools"""
+        self.rqs.executor.shutdown()
+        self.rqs.close()
+        if self.decoder is not None:
+            self.decoder.shutdown()
+            self.decoder = None
+        with self._wlock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._rlock:
+            readers, self._readers = self._readers, set()
+        for con in readers:
+            con.close()
+        # drops the reader cursors, whose finalizers take the lock
+        self._local = threading.local()
+
+    def _connect(self):
+        con = sqlite3.connect(
+            self.db, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        cur = con.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cur.execute(pragma)
+        self._migrate(con)
+        return con
+
+    def _migrations(self):
+        """Schema migrations in order, each a list of SQL statements and
+        functions of a cursor. Applying migration i brings a database to
+        user_version i + 1. Only ever append to this list, and keep every
+        step safe to run on a database that already has its changes."""
+        return [
+            [SQL_SENSOR_TABLE, SQL_TMPO_TABLE],
+            [SQL_TMPO_RANGE_IDX, SQL_ROLLUP_TABLE, SQL_ROLLUP_IDX],
+            [self._migrate_headers, SQL_TMPO_HEAD_IDX, SQL_TMPO_TAIL_IDX],
+            [SQL_TMPO_LAST_IDX],
+            [SQL_SYNC_TABLE],
+            [SQL_ARRAY_TABLE],
+            [self._migrate_arrays]]
+
+    def _migrate(self, con):
+        """Apply the migrations the database has not seen yet, in one
+        transaction, and record the new version in PRAGMA user_version"""
+        cur = con.cursor()
+        migrations = self._migrations()
+        version, = cur.execute(SQL_SCHEMA_VERSION).fetchone()
+        if version >= len(migrations):
+            return
+        # take the write lock first, another connection may be migrating
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            version, = cur.execute(SQL_SCHEMA_VERSION).fetchone()
+            for version in range(version, len(migrations)):
+                for step in migrations[version]:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute(SQL_SCHEMA_VERSION_SET % (version + 1))
+        except BaseException:
+            con.rollback()
+            raise
+        con.commit()
+
+    def _migrate_arrays(self, cur):
+        """Version the memory mapped arrays. Their records are dropped, so
+        they are rebuilt under versioned names on first use, and the
+        unversioned files removed."""
+        columns = [c[1] for c in cur.execute("PRAGMA table_info(tmpo_array)")]
+        if "version" in columns:
+            return
+        cur.execute(SQL_ARRAY_VERSION)
+        cur.execute(SQL_ARRAY_CLEAR)
+        shutil.rmtree(os.path.join(self.home, "arrays"), ignore_errors=True)
+
+    def _migrate_headers(self, cur):
+        """Add the block header columns to databases created before they
+        existed and fill them in for the blocks already stored"""
+        columns = [c[1] for c in cur.execute("PRAGMA table_info(tmpo)")]
+        if "tail_t" in columns:
+            return
+        for column in SQL_TMPO_HEADER_COLUMNS:
+            cur.execute(SQL_TMPO_ADD_COLUMN % column)
+        rows = cur.execute(SQL_TMPO_NO_HEADER).fetchall()
+        cur.executemany(SQL_TMPO_SET_HEADER, [
+            self._header(*_blk2arrays(ext, blk)) + (sid, rid, lvl, bid)
+            for sid, rid, lvl, bid, ext, ctd, blk in rows])
+
+    @transactional
     def add(self, sid, token):
         """
         Add new sensor to the database
@@ -225,7 +1745,7 @@ class Session():
         except sqlite3.IntegrityError:  # sensor entry exists
             pass
 
-    @dbcon
+    @transactional
     def remove(self, sid):
         """
         Remove sensor from the database
@@ -236,9 +1756,13 @@ class Session():
             SensorID
         """
         self.dbcur.execute(SQL_SENSOR_DEL, (sid,))
-        self.dbcur.execute(SQL_TMPO_DEL, (sid,))
+        self.dbcur.execute(SQL_SYNC_DEL, (sid,))
+        self.storage.delete(sid)
+        self.dbcur.execute(SQL_ROLLUP_DEL, (sid,))
+        self.cache.invalidate(sid)
+        self.series_cache.invalidate(sid)
 
-    @dbcon
+    @transactional
     def reset(self, sid):
         """
         Removes all tmpo blocks for a given sensor, but keeps sensor table
@@ -248,35 +1772,250 @@ class Session():
         ----------
         sid : str
         """
-        self.dbcur.execute(SQL_TMPO_DEL, (sid,))
+        self.dbcur.execute(SQL_SYNC_DEL, (sid,))
+        self.storage.delete(sid)
+        self.dbcur.execute(SQL_ROLLUP_DEL, (sid,))
+        self.cache.invalidate(sid)
+        self.series_cache.invalidate(sid)
 
-    @dbcon
-    def sync(self, *sids):
+    def sync(self, *sids, limiter=None):
         """
         Synchronise data
 
+        The sync listings and block downloads of all sensors share at most
+        `inflight` outstanding requests, a limit that adapts to the latency
+        and errors seen. Failed requests are retried HTTP_RETRIES times with
+        jittered exponential backoff. A failing sensor does not stop the
+        others, and keeps the blocks it downloaded up to the first failed
+        one, so the next sync resumes from there.
+
+        Sensors are leased SYNC_BATCH at a time in the tmpo_sync table as the
+        outstanding requests leave room for more, and released once their
+        blocks are written, so sessions in several processes sharing the
+        database split the sensors between them. Sensors leased by another
+        session, or synced by one since this sync started, are skipped and
+        left out of the result.
+        Leases expire after SYNC_LEASE seconds unless renewed, so the
+        sensors of a crashed session are taken over by the next sync.
+
         Parameters
         ----------
         sids : list of str
             SensorIDs to sync
             Optional, leave empty to sync everything
+        limiter : object, optional
+            rate limit on requests, asked before each one: its acquire()
+            returns 0 when the request may go, or else the seconds to wait
+            before asking again
+            default None
+
+        Returns
+        -------
+        dict
+            number of blocks written per SensorID, or the exception that
+            interrupted the sync of that sensor
         """
+        results = {}
+        start = time.time()
         if sids == ():
-            sids = [sid for (sid,) in self.dbcur.execute(SQL_SENSOR_ALL)]
+            sids = self._sensors()
+        self._sync_pipeline(collections.deque(sids), start, results, limiter)
+        return results
+
+    def _sensors(self):
+        return [sid for (sid,) in self.dbcur.execute(SQL_SENSOR_ALL)]
+
+    @transactional
+    def _lease(self, sids, start):
+        """Lease up to SYNC_BATCH of the sensors not synced since start,
+        taking them off the front of sids"""
+        now = time.time()
+        leased = []
+        while sids and len(leased) < SYNC_BATCH:
+            sid = sids.popleft()
+            self.dbcur.execute(SQL_SYNC_INS, (sid,))
+            self.dbcur.execute(SQL_SYNC_LEASE, (
+                self.owner, now + SYNC_LEASE, sid, now, start))
+            if self.dbcur.rowcount == 1:
+                leased.append(sid)
+        self._renewed = now
+        return leased
+
+    def _renew(self):
+        """Extend the leases of this session once a third of SYNC_LEASE has
+        passed since they were taken or last renewed"""
+        now = time.time()
+        if now < self._renewed + SYNC_LEASE / 3.0:
+            return
+        with self.transaction():
+            self.dbcur.execute(SQL_SYNC_RENEW, (now + SYNC_LEASE, self.owner))
+        self._renewed = now
+
+    @transactional
+    def _release(self, sids, results):
+        """Record the sync position of the sensors that synced without an
+        error and give up the leases on sids"""
+        now = time.time()
+        for sid in sids:
+            if sid in results and not isinstance(results[sid], Exception):
+                self.dbcur.execute(SQL_TMPO_LAST, (sid,))
+                last = self.dbcur.fetchone()
+                rid, lvl, bid = last[:3] if last else (None, None, None)
+                self.dbcur.execute(SQL_SYNC_DONE, (
+                    rid, lvl, bid, now, sid, self.owner))
+            self.dbcur.execute(SQL_SYNC_RELEASE, (sid, self.owner))
+
+    @transactional
+    def _sync_heads(self, sids, results):
+        """List (sid, token, rid, lvl, bid) to sync from, skipping sensors
+        that were polled recently"""
+        heads = []
         for sid in sids:
             self.dbcur.execute(SQL_TMPO_LAST, (sid,))
             last = self.dbcur.fetchone()
+            results[sid] = 0
             if last:
                 rid, lvl, bid, ext = last
-                self._clean(sid, rid, lvl, bid)
+                self._clean((sid, rid, lvl, bid))
                 # prevent needless polling
                 if time.time() < bid + 256:
-                    return
+                    continue
             else:
                 rid, lvl, bid = 0, 0, 0
-            self._req_sync(sid, rid, lvl, bid)
+            heads.append((sid, self._token(sid), rid, lvl, bid))
+        return heads
+
+    def _sync_pipeline(self, sids, start, results, limiter=None):
+        """Lease the sensors of sids as the outstanding requests leave room
+        under the concurrency limit, request their sync listings, fan out
+        block requests as listings come in, as far as the limiter allows,
+        and write blocks as they arrive, in batches of WRITE_BATCH rows. The
+        rows of a sensor are only written once all of its blocks have been
+        downloaded, or up to the first block that failed for good, and its
+        lease is released once they are."""
+        queue = collections.deque()
+        retries = []  # heap of (due, seq, request)
+        seq = itertools.count()
+        pending = {}
+        blocks = {}  # sid -> [outstanding block count, listing, contents]
+        rows, arrays = [], []
+        leased = set()
+        done = []  # sensors to release once their rows are written
+        limit = self.concurrency
+        try:
+            while sids or pending or queue or retries:
+                self._renew()
+                while sids and (len(queue) + len(pending) + len(retries) <
+                                int(limit.limit)):
+                    chunk = self._lease(sids, start)
+                    leased.update(chunk)
+                    heads = self._sync_heads(chunk, results)
+                    queue.extend((sid, token, (rid, lvl, bid), 0)
+                                 for sid, token, rid, lvl, bid in heads)
+                    polled = set(head[0] for head in heads)
+                    done.extend(sid for sid in chunk if sid not in polled)
+                now = time.time()
+                while retries and retries[0][0] <= now:
+                    queue.append(heapq.heappop(retries)[2])
+                delay = 0
+                while queue and len(pending) < int(limit.limit):
+                    if isinstance(results[queue[0][0]], Exception):
+                        queue.popleft()
+                        continue
+                    if limiter is not None:
+                        delay = limiter.acquire()
+                        if delay:
+                            break
+                    sid, token, t, attempt = queue.popleft()
+                    if isinstance(t, dict):
+                        f = self._req_block(sid, token, t["rid"], t["lvl"],
+                                            t["bid"], t["ext"])
+                    else:
+                        f = self._req_sync(sid, token, *t)
+                    pending[f] = (sid, token, t, attempt)
+                waits = [retries[0][0] - now] if retries else []
+                if delay:
+                    waits.append(delay)
+                timeout = max(0, min(waits + [SYNC_LEASE / 3.0]))
+                if pending:
+                    finished, _ = concurrent.futures.wait(
+                        pending, timeout=timeout,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                else:
+                    if waits:
+                        time.sleep(timeout)
+                    finished = ()
+                for f in finished:
+                    sid, token, t, attempt = pending.pop(f)
+                    if isinstance(results[sid], Exception):
+                        continue
+                    block = isinstance(t, dict)
+                    try:
+                        r = f.result()
+                        self.metrics.timing(
+                            "http.block" if block else "http.sync",
+                            r.elapsed.total_seconds())
+                        self.metrics.count("http.bytes", len(r.content))
+                        r.raise_for_status()
+                        if not block:
+                            tlist = r.json()
+                    except (requests.exceptions.RequestException,
+                            ValueError) as e:
+                        if attempt < HTTP_RETRIES and _retryable(e):
+                            limit.failure()
+                            self.metrics.count("http.retry")
+                            heapq.heappush(retries, (
+                                time.time() + _backoff(attempt), next(seq),
+                                (sid, token, t, attempt + 1)))
+                            continue
+                        results[sid] = e
+                        done.append(sid)
+                        sblocks = blocks.pop(sid, None)
+                        if sblocks is not None:
+                            # keep what was downloaded before the failed block
+                            tlist, contents = sblocks[1], []
+                            for t in tlist:
+                                if id(t) not in sblocks[2]:
+                                    break
+                                contents.append(sblocks[2][id(t)])
+                            brows, barrays, _ = self._block_rows(
+                                sid, tlist[:len(contents)], contents)
+                            rows.extend(brows)
+                            arrays.extend(barrays)
+                        continue
+                    limit.success(r.elapsed.total_seconds())
+                    if not block:
+                        if not tlist:
+                            done.append(sid)
+                            continue
+                        blocks[sid] = [len(tlist), tlist, {}]
+                        queue.extend((sid, token, t, 0) for t in tlist)
+                        continue
+                    sblocks = blocks[sid]
+                    sblocks[0] -= 1
+                    sblocks[2][id(t)] = r.content
+                    if sblocks[0] == 0:
+                        del blocks[sid]
+                        tlist = sblocks[1]
+                        contents = [sblocks[2][id(t)] for t in tlist]
+                        brows, barrays, e = self._block_rows(
+                            sid, tlist, contents)
+                        results[sid] = len(brows) if e is None else e
+                        done.append(sid)
+                        rows.extend(brows)
+                        arrays.extend(barrays)
+                if len(rows) >= WRITE_BATCH:
+                    self._store(rows, arrays)
+                    rows, arrays = [], []
+                if done and not rows:
+                    self._release(done, results)
+                    leased.difference_update(done)
+                    done = []
+            if rows:
+                self._store(rows, arrays)
+        finally:
+            self._release(leased, results)
 
-    @dbcon
     def list(self, *sids):
         """
         List all tmpo-blocks in the database
@@ -296,14 +2035,15 @@ class Session():
         slist = []
         for sid in sids:
             tlist = []
-            for tmpo in self.dbcur.execute(SQL_TMPO_ALL, (sid,)):
+            for tmpo in self.storage.list(sid):
                 tlist.append(tmpo)
-                sid, rid, lvl, bid, ext, ctd, blk = tmpo
-                self._dprintf(DBG_TMPO_WRITE, ctd, sid, rid, lvl, bid, len(blk))
+                if self.debug:
+                    sid, rid, lvl, bid, ext, ctd, blk = tmpo
+                    self._dprintf(DBG_TMPO_WRITE, ctd, sid, rid, lvl, bid,
+                                  len(blk or b""))
             slist.append(tlist)
         return slist
 
-    @dbcon
     def series(self, sid, recycle_id=None, head=None, tail=None,
                datetime=True):
         """
@@ -337,27 +2077,109 @@ class Session():
         else:
             tail = self._2epochs(tail)
 
-        if recycle_id is None:
-            self.dbcur.execute(SQL_TMPO_RID_MAX, (sid,))
-            recycle_id = self.dbcur.fetchone()[0]
-        tlist = self.list(sid)[0]
-        srlist = []
-        for _sid, rid, lvl, bid, ext, ctd, blk in tlist:
-            if (recycle_id == rid
-            and head < self._blocktail(lvl, bid)
-            and tail >= bid):
-                srlist.append(self._blk2series(ext, blk, head, tail))
-        if len(srlist) > 0:
-            ts = pd.concat(srlist)
-            ts.name = sid
+        arrays = self._range(sid, self._rid(sid, recycle_id), head, tail)
+        return self._arrays2series(sid, arrays, head, tail, datetime)
+
+    def array(self, sid, recycle_id=None, head=None, tail=None,
+              epoch_dtype=np.int64, value_dtype=np.float64):
+        """
+        Data of a sensor as plain NumPy arrays, without building a Series or
+        converting the index. The arrays are filled block by block, in the
+        requested types, so a float32 or int32 result takes half the memory
+        of the default.
+
+        Parameters
+        ----------
+        sid : str
+        recycle_id : optional
+        head : int | pandas.Timestamp, optional
+            Start of the interval
+            default earliest available
+        tail : int | pandas.Timestamp, optional
+            End of the interval
+            default max epoch
+        epoch_dtype : numpy.dtype
+            integer type of 32 bits or more, e.g. numpy.int32
+            default numpy.int64
+        value_dtype : numpy.dtype
+            float or integer type, e.g. numpy.float32 or numpy.int64 for
+            counters. Integer types raise a ValueError for values they
+            cannot hold exactly.
+            default numpy.float64
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+            epochs and values
+        """
+        head = 0 if head is None else self._2epochs(head)
+        tail = EPOCHS_MAX if tail is None else self._2epochs(tail)
+        arrays = self._range(sid, self._rid(sid, recycle_id), head, tail)
+        return self._concat(arrays, head, tail, epoch_dtype, value_dtype)
+
+    def iter_blocks(self, sid, head=None, tail=None, recycle_id=None):
+        """
+        Iterate over the data of a sensor block by block, in time order.
+        Blocks are read from storage one at a time, with the default storage
+        on a connection of the iterator's own, so memory use does not grow
+        with the history.
+
+        Parameters
+        ----------
+        sid : str
+        head : int | pandas.Timestamp, optional
+            Start of the interval
+            default earliest available
+        tail : int | pandas.Timestamp, optional
+            End of the interval
+            default max epoch
+        recycle_id : optional
+
+        Yields
+        ------
+        (numpy.ndarray, numpy.ndarray)
+            epochs and values of a block, truncated to the interval
+        """
+        head = 0 if head is None else self._2epochs(head)
+        tail = EPOCHS_MAX if tail is None else self._2epochs(tail)
+        rid = self._rid(sid, recycle_id)
+        for t, v in self.storage.iter_range(sid, rid, head, tail):
+            t, v = _truncate(t, v, head, tail)
+            if len(t) > 0:
+                yield t, v
+
+    def iter_series(self, sid, head=None, tail=None, recycle_id=None,
+                    datetime=True):
+        """
+        Iterate over the data of a sensor as one Series per block, in time
+        order. See iter_blocks.
+
+        Parameters
+        ----------
+        sid : str
+        head : int | pandas.Timestamp, optional
+            Start of the interval
+            default earliest available
+        tail : int | pandas.Timestamp, optional
+            End of the interval
+            default max epoch
+        recycle_id : optional
+        datetime : bool
+            convert index to datetime
+            default True
+
+        Yields
+        ------
+        pandas.Series
+        """
+        for t, v in self.iter_blocks(sid, head, tail, recycle_id):
+            ts = pd.Series(v, index=t, name=sid)
             if datetime is True:
                 ts.index = pd.to_datetime(ts.index, unit="s", utc=True)
-            return ts
-        else:
-            return pd.Series([], name=sid)
+            yield ts
 
-    @dbcon
-    def dataframe(self, sids, head=0, tail=EPOCHS_MAX, datetime=True):
+    def dataframe(self, sids, head=0, tail=EPOCHS_MAX, datetime=True,
+                  freq=None, fill="ffill"):
         """
         Create data frame
 
@@ -373,6 +2195,18 @@ class Session():
         datetime : bool
             convert index to datetime
             default True
+        freq : str | int, optional
+            align all sensors on a common grid with this spacing, given as a
+            pandas frequency or in seconds, instead of joining their raw
+            timestamps. Spacings below a second or with a fraction of one
+            raise a ValueError.
+            default None
+        fill : str | None
+            how a sensor is mapped onto the grid: "ffill" takes the last
+            sample at or before each grid point, "bfill" the first one at or
+            after it, "nearest" the closest one, "linear" interpolates and
+            None only keeps exact matches
+            default "ffill"
 
         Returns
         -------
@@ -388,14 +2222,156 @@ class Session():
         else:
             tail = self._2epochs(tail)
 
-        series = [self.series(sid, head=head, tail=tail, datetime=False)
-                  for sid in sids]
-        df = pd.concat(series, axis=1)
+        sarrays = self._ranges(
+            [(sid, self._rid(sid, None), head, tail) for sid in sids])
+        if freq is not None:
+            df = self._align(sids, sarrays, head, tail, freq, fill)
+        else:
+            series = [self._arrays2series(sid, a, head, tail, False)
+                      for sid, a in zip(sids, sarrays)]
+            df = pd.concat(series, axis=1)
         if datetime is True:
             df.index = pd.to_datetime(df.index, unit="s", utc=True)
         return df
 
-    @dbcon
+    def arrays(self, sids, head=0, tail=EPOCHS_MAX, epoch_dtype=np.int64,
+               value_dtype=np.float64):
+        """
+        Data of several sensors as plain NumPy arrays, see array(). Sensors
+        keep their own timestamps instead of being joined on a common index.
+
+        Parameters
+        ----------
+        sids : list[str]
+        head : int | pandas.Timestamp, optional
+            Start of the interval
+            default earliest available
+        tail : int | pandas.Timestamp, optional
+            End of the interval
+            default max epoch
+        epoch_dtype : numpy.dtype
+            default numpy.int64
+        value_dtype : numpy.dtype
+            default numpy.float64
+
+        Returns
+        -------
+        collections.OrderedDict
+            (epochs, values) arrays per SensorID
+        """
+        head = 0 if head is None else self._2epochs(head)
+        tail = EPOCHS_MAX if tail is None else self._2epochs(tail)
+        sarrays = self._ranges(
+            [(sid, self._rid(sid, None), head, tail) for sid in sids])
+        return collections.OrderedDict(
+            (sid, self._concat(a, head, tail, epoch_dtype, value_dtype))
+            for sid, a in zip(sids, sarrays))
+
+    def aggregate(self, sid, head=None, tail=None, freq="1h", how="mean",
+                  recycle_id=None, datetime=True):
+        """
+        Aggregate data into fixed intervals, answered from the rollups stored
+        with each block. Raw blocks are only decoded for the partial buckets
+        at the edges of the interval.
+
+        Parameters
+        ----------
+        sid : str
+        head : int | pandas.Timestamp, optional
+            Start of the interval
+            default earliest available
+        tail : int | pandas.Timestamp, optional
+            End of the interval
+            default max epoch
+        freq : str | int
+            bucket size as a pandas frequency or in seconds, buckets are
+            aligned to the epoch
+            default "1h"
+        how : str | list[str]
+            count, first, last, min, max, mean and/or sum
+            default "mean"
+        recycle_id : optional
+        datetime : bool
+            convert index to datetime
+            default True
+
+        Returns
+        -------
+        pandas.Series | pandas.DataFrame
+            Series for a single aggregation, DataFrame for a list
+        """
+        head = 0 if head is None else self._2epochs(head)
+        tail = EPOCHS_MAX if tail is None else self._2epochs(tail)
+        if not isinstance(freq, int):
+            freq = int(pd.Timedelta(freq).total_seconds())
+        hows = [how] if isinstance(how, str) else list(how)
+        for h in hows:
+            if h not in ROLLUP_HOW:
+                raise NotImplementedError("Aggregation not supported. " +
+                                          "Use one of %s." % (ROLLUP_HOW,))
+
+        if recycle_id is None:
+            self.dbcur.execute(SQL_TMPO_RID_MAX, (sid,))
+            recycle_id = self.dbcur.fetchone()[0]
+        resolutions = [res for res in ROLLUP_RES if freq % res == 0]
+        res = resolutions[-1] if resolutions else None
+
+        # buckets fully inside [head, tail] come from the stored rollups
+        if res is not None:
+            inner_head = -(-head // res) * res
+            inner_tail = (tail + 1) // res * res
+        if res is None or inner_head >= inner_tail:
+            inner_head = inner_tail = tail + 1
+        self._rollup_missing(sid, recycle_id, inner_head, inner_tail - 1)
+        parts = [self._rollup_raw(sid, recycle_id, head, inner_head - 1,
+                                  res or freq)]
+        if inner_head < inner_tail:
+            rows = self.dbcur.execute(SQL_ROLLUP_RANGE, (
+                sid, recycle_id, res, inner_head, inner_tail)).fetchall()
+            cols = list(zip(*rows)) or [()] * 7
+            parts.append(tuple(np.array(c, dtype=d) for c, d in zip(
+                cols, [np.int64] * 2 + [np.float64] * 5)))
+            parts.append(self._rollup_raw(
+                sid, recycle_id, inner_tail, tail, res))
+
+        columns = ["ts", "count", "first", "last", "min", "max", "sum"]
+        df = pd.concat([pd.DataFrame(dict(zip(columns, part)),
+                                     columns=columns) for part in parts])
+        df = df.groupby(df["ts"] // freq * freq).agg({
+            "count": "sum", "first": "first", "last": "last",
+            "min": "min", "max": "max", "sum": "sum"})
+        df["mean"] = df["sum"] / df["count"]
+        df.index.name = None
+        if datetime is True:
+            df.index = pd.to_datetime(df.index, unit="s", utc=True)
+        if isinstance(how, str):
+            ts = df[how]
+            ts.name = sid
+            return ts
+        return df[hows]
+
+    def _rollup_raw(self, sid, rid, head, tail, res):
+        """Bucket the raw samples in [head, tail]"""
+        if head > tail:
+            return (np.empty(0, dtype=np.int64),) * 2 + (np.empty(0),) * 5
+        arrays = [_truncate(t, v, head, tail) for t, v in
+                  self.storage.range(sid, rid, head, tail)]
+        if not arrays:
+            return self._rollup_raw(sid, rid, 1, 0, res)
+        t, v = (np.concatenate(a) for a in zip(*arrays))
+        return _rollup(t, v, res)
+
+    def _rollup_missing(self, sid, rid, head, tail):
+        """Store rollups of blocks in [head, tail] written before rollups
+        were introduced"""
+        if head > tail:
+            return
+        rows = self.dbcur.execute(SQL_ROLLUP_MISSING, (
+            sid, rid, tail, self._blockhead(LVL_MAX, head), head)).fetchall()
+        if rows:
+            with self.transaction():
+                self._write_rollups(rows)
+
     def first_timestamp(self, sid, epoch=False):
         """
         Get the first available timestamp for a sensor
@@ -413,14 +2389,13 @@ class Session():
         -------
         pd.Timestamp | int
         """
-        first_block = self.dbcur.execute(SQL_TMPO_FIRST, (sid,)).fetchone()
-        if first_block is None:
+        first = self.dbcur.execute(SQL_TMPO_FIRST, (sid,)).fetchone()
+        if first is None:
             return None
 
-        timestamp = first_block[2]
+        timestamp = first[0]
         if not epoch:
-            timestamp = pd.Timestamp.utcfromtimestamp(timestamp)
-            timestamp = timestamp.tz_localize('UTC')
+            timestamp = self._2timestamp(timestamp)
         return timestamp
 
     def last_timestamp(self, sid, epoch=False):
@@ -458,37 +2433,496 @@ class Session():
         -------
         pd.Timestamp | int, float
         """
-        block = self._last_block(sid)
-        if block is None:
+        last = self.dbcur.execute(SQL_TMPO_LAST_DATA, (sid,)).fetchone()
+        if last is None:
             return None, None
 
-        header = block['h']
-        timestamp, value = header['tail']
-
+        timestamp, value = last
         if not epoch:
-            timestamp = pd.Timestamp.utcfromtimestamp(timestamp)
-            timestamp = timestamp.tz_localize('UTC')
+            timestamp = self._2timestamp(timestamp)
 
         return timestamp, value
 
-    @dbcon
-    def _last_block(self, sid):
-        cur = self.dbcur.execute(SQL_TMPO_LAST_DATA, (sid,))
-        row = cur.fetchone()
-        if row is None:
-            return None
+    def last_datapoints(self, sids=None, epoch=False):
+        """
+        Get the last datapoint of many sensors at once
+
+        Parameters
+        ----------
+        sids : list[str], optional
+            SensorIDs
+            default all sensors with data
+        epoch : bool
+            default False
+            If True return timestamps as epochs
+            If False return timestamps as pd.Timestamp
+
+        Returns
+        -------
+        pandas.DataFrame
+            timestamp and value columns indexed by SensorID, NaN for sensors
+            without data
+        """
+        if sids is None:
+            rows = self.dbcur.execute(SQL_TMPO_LAST_DATA_ALL).fetchall()
+        else:
+            sids = list(sids)
+            unique = list(collections.OrderedDict.fromkeys(sids))
+            rows = []
+            for i in range(0, len(unique), SQLITE_VARIABLES):
+                chunk = unique[i:i + SQLITE_VARIABLES]
+                sql = SQL_TMPO_LAST_DATA_MANY % ", ".join("?" * len(chunk))
+                rows.extend(self.dbcur.execute(sql, chunk).fetchall())
+        df = pd.DataFrame(rows, columns=["sid", "timestamp", "value"])
+        df = df.set_index("sid")
+        if sids is not None:
+            df = df.reindex(sids)
+        if not epoch:
+            df["timestamp"] = pd.to_datetime(
+                df["timestamp"], unit="s", utc=True)
+        return df
+
+    def transcode(self, *sids):
+        """
+        Rewrite the gzip json blocks stored in the database in the compact
+        bin format, in place, WRITE_BATCH blocks per transaction. Blocks are
+        transcoded on the decoder pool if the session has one. Run VACUUM on
+        the database afterwards to hand the space saved back to the file
+        system.
 
-        rid, lvl, bid, ext, blk = row
+        Parameters
+        ----------
+        sids : list of str
+            SensorIDs to transcode
+            Optional, leave empty to transcode everything
 
-        jblk = self._decompress_block(blk, ext)
-        data = json.loads(jblk.decode('UTF-8'))
-        return data
+        Returns
+        -------
+        dict
+            number of blocks transcoded per SensorID
+        """
+        if sids == ():
+            sids = self._sensors()
+        results = {}
+        for sid in sids:
+            results[sid] = 0
+            while True:
+                rows = self.dbcur.execute(
+                    SQL_TMPO_EXT, (sid, "gz", WRITE_BATCH)).fetchall()
+                if not rows:
+                    break
+                blks = [row[6] for row in rows]
+                if self.decoder is None:
+                    encoded = [_gz2bin(blk) for blk in blks]
+                else:
+                    encoded = list(self.decoder.map(_gz2bin, blks))
+                with self.transaction():
+                    self.dbcur.executemany(SQL_TMPO_SET_DATA, [
+                        (BIN_EXT, blk) + row[:4]
+                        for row, (blk, arrays) in zip(rows, encoded)])
+                results[sid] += len(rows)
+        return results
+
+    def export(self, path, sids=None, head=None, tail=None,
+               format="parquet", workers=None):
+        """
+        Write the data of sensors to columnar files, one per sensor and UTC
+        month, in a sid=<sid>/month=<yyyy-mm> directory tree under path.
+        Partitions are streamed from storage and written in batches, so
+        memory use does not grow with the history, and each worker process
+        exports its own partitions. Requires pyarrow.
 
-    def _decompress_block(self, blk, ext):
-        if ext != "gz":
-            raise NotImplementedError("Compression type not supported in tmpo")
-        jblk = zlib.decompress(blk, zlib.MAX_WBITS | 16)  # gzip decoding
-        return jblk
+        The state of the export is kept in a manifest in path. Exporting to
+        the same path again only rewrites the months touched by blocks
+        created since, unless the recycle id, interval or format changed.
+
+        Parameters
+        ----------
+        path : str
+            export directory
+        sids : list of str, optional
+            default all sensors
+        head : int | pandas.Timestamp, optional
+            Start of the interval
+            default earliest available
+        tail : int | pandas.Timestamp, optional
+            End of the interval
+            default max epoch
+        format : str
+            "parquet" or "arrow" (IPC file)
+            default "parquet"
+        workers : int, optional
+            number of worker processes, 1 exports in the calling thread
+            default number of CPUs
+
+        Returns
+        -------
+        dict
+            number of month partitions written per SensorID, months left
+            without samples have their file removed and are not counted
+        """
+        if format not in EXPORT_FORMATS:
+            raise NotImplementedError("Export format not supported. " +
+                                      "Use 'parquet' or 'arrow'.")
+        if pa is None:
+            raise ImportError("Export requires pyarrow")
+        head = 0 if head is None else self._2epochs(head)
+        tail = EPOCHS_MAX if tail is None else self._2epochs(tail)
+        if sids is None:
+            sids = [sid for (sid,) in self.dbcur.execute(SQL_SENSOR_ALL)]
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        manifest = os.path.join(path, EXPORT_MANIFEST)
+        try:
+            with io.open(manifest, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (IOError, OSError):  # first export to path
+            state = {}
+        todo = collections.OrderedDict()
+        for sid in sids:
+            rid = self._rid(sid, None)
+            if rid is None:
+                continue
+            self.dbcur.execute(SQL_TMPO_CREATED_MAX, (sid, rid))
+            created, = self.dbcur.fetchone()
+            entry = {"rid": rid, "head": head, "tail": tail,
+                     "format": format, "created": created}
+            last = state.get(sid)
+            if last is not None and all(
+                    last.get(k) == entry[k] for k in entry if k != "created"):
+                since = last["created"]
+            else:
+                since = -1.0
+                shutil.rmtree(os.path.join(path, "sid=%s" % sid),
+                              ignore_errors=True)
+            months = set()
+            for lvl, bid in self.dbcur.execute(SQL_TMPO_EXPORT, (
+                    sid, rid, since, tail, head)).fetchall():
+                months.update(_months(max(bid, head),
+                                      min(bid + (1 << lvl) - 1, tail)))
+            todo[sid] = (entry, [
+                (sid, rid, max(m, head), min(self._month_end(m), tail),
+                 self._export_file(path, sid, m, format), format)
+                for m in sorted(months)])
+
+        def done(sid):
+            state[sid] = todo[sid][0]
+            tmp = manifest + ".tmp"
+            with io.open(tmp, "w", encoding="utf-8") as f:
+                f.write(json.dumps(state, sort_keys=True))
+            os.replace(tmp, manifest)
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        results = {}
+        if workers == 1:
+            for sid, (entry, jobs) in todo.items():
+                results[sid] = sum(
+                    1 for job in jobs if self._export_partition(*job) > 0)
+                done(sid)
+            return results
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = {}
+            for sid, (entry, jobs) in todo.items():
+                results[sid] = 0
+                if not jobs:
+                    done(sid)
+                for job in jobs:
+                    futures[pool.submit(_export_partition, self.home,
+                                        type(self.storage), *job)] = sid
+            pending = collections.Counter(futures.values())
+            for f in concurrent.futures.as_completed(futures):
+                sid = futures[f]
+                if f.result() > 0:
+                    results[sid] += 1
+                pending[sid] -= 1
+                if pending[sid] == 0:
+                    done(sid)
+        return results
+
+    def _export_file(self, path, sid, month, format):
+        label = str(np.datetime64(int(month), "s").astype("datetime64[M]"))
+        return os.path.join(path, "sid=%s" % sid, "month=%s" % label,
+                            "%s-%s%s" % (sid, label, EXPORT_FORMATS[format]))
+
+    def _month_end(self, month):
+        """Last epoch of the month starting at epoch month"""
+        m = np.datetime64(int(month), "s").astype("datetime64[M]") + 1
+        return int(m.astype("datetime64[s]").astype(np.int64)) - 1
+
+    def _export_partition(self, sid, rid, head, tail, fname, format):
+        """Stream the data of a sensor in [head, tail] to fname, replacing
+        it, in batches of about EXPORT_ROWS rows"""
+        schema = pa.schema([("timestamp", pa.timestamp("s", tz="UTC")),
+                            ("value", pa.float64())])
+        directory = os.path.dirname(fname)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = fname + ".tmp"
+        sink = pa.OSFile(tmp, "wb")
+        if format == "parquet":
+            import pyarrow.parquet
+            writer = pa.parquet.ParquetWriter(sink, schema)
+        else:
+            writer = pa.ipc.new_file(sink, schema)
+        rows = nbatch = 0
+        batch = []
+
+        def flush():
+            t, v = (np.concatenate(a) for a in zip(*batch))
+            writer.write_table(pa.table([
+                pa.array(t, pa.int64()).cast(schema.field(0).type),
+                pa.array(v, pa.float64())], schema=schema))
+            del batch[:]
+
+        try:
+            for t, v in self.storage.iter_range(sid, rid, head, tail):
+                t, v = _truncate(t, v, head, tail)
+                if len(t) == 0:
+                    continue
+                batch.append((t, v))
+                rows += len(t)
+                nbatch += len(t)
+                if nbatch >= EXPORT_ROWS:
+                    flush()
+                    nbatch = 0
+            if batch:
+                flush()
+        finally:
+            writer.close()
+            sink.close()
+        if rows == 0:
+            os.remove(tmp)
+            if os.path.exists(fname):
+                os.remove(fname)
+        else:
+            os.replace(tmp, fname)
+        return rows
+
+    def _rid(self, sid, recycle_id):
+        if recycle_id is None:
+            self.dbcur.execute(SQL_TMPO_RID_MAX, (sid,))
+            recycle_id = self.dbcur.fetchone()[0]
+        return recycle_id
+
+    def _range(self, sid, rid, head, tail):
+        """Arrays of a sensor recycle id overlapping [head, tail], through the
+        series cache if it is enabled"""
+        return self._ranges([(sid, rid, head, tail)])[0]
+
+    def _ranges(self, queries):
+        """_range() of many (sid, rid, head, tail) queries. The spans the
+        series cache misses are read in one storage.ranges() call, holding
+        the locks of the entries involved only, so queries of other sensors
+        proceed meanwhile."""
+        if self.series_cache.size == 0:
+            return self.storage.ranges(queries)
+        # one plan per entry, over all queries of it
+        spans = collections.OrderedDict()
+        for sid, rid, head, tail in queries:
+            if rid is not None:
+                span = spans.setdefault((sid, rid), (head, tail))
+                spans[sid, rid] = (min(span[0], head), max(span[1], tail))
+        locks = sorted(set(hash(key) % SERIES_LOCKS for key in spans))
+        for i in locks:
+            self._slocks[i].acquire()
+        try:
+            plans = collections.OrderedDict(
+                (key, self._series_plan(key[0], key[1], *span))
+                for key, span in spans.items())
+            reads = [query for query in queries if query[1] is None]
+            for key, plan in plans.items():
+                reads.extend(key + span for span in plan[1])
+            arrays = iter(self.storage.ranges(reads))
+            ranges = dict(
+                (query, next(arrays)) for query in queries
+                if query[1] is None)
+            for key, (entry, merged, held, stored) in plans.items():
+                self._series_splice(
+                    key, entry, merged, held, stored,
+                    [next(arrays) for span in merged])
+            for sid, rid, head, tail in queries:
+                if rid is None:
+                    continue
+                entry = plans[sid, rid][0]
+                if any(bid <= tail and bid + (1 << lvl) > head
+                       for lvl, bid in entry.blocks):
+                    ranges[sid, rid, head, tail] = [entry.slice(head, tail)]
+                else:
+                    ranges[sid, rid, head, tail] = []
+        finally:
+            for i in locks:
+                self._slocks[i].release()
+        return [ranges[query] for query in queries]
+
+    def _series_plan(self, sid, rid, head, tail):
+        """Widen the series cache entry of a sensor recycle id to [head, tail]
+        and compare the blocks it holds with the stored ones, by (lvl, bid,
+        created), over the part of the interval it covered and the part it
+        gains. Only the time spans of blocks that were added, replaced or
+        cleaned since need to be read from storage and spliced in. As the
+        tmpo table is compared, blocks written by other processes are picked
+        up as well.
+
+        Returns
+        -------
+        (_Series, list, dict, dict)
+            the entry, the merged (head, tail) spans to read, and the held
+            and stored (lvl, bid): created blocks to swap once they are read
+        """
+        cache = self.series_cache
+        entry = cache.get((sid, rid))
+        fresh = entry is None
+        if fresh:
+            entry = _Series(head, tail)
+            self.metrics.count("series.miss")
+        lo, hi = head, tail
+        edge = {}  # blocks crossing an edge, only read up to it
+        if head < entry.lo:
+            hi = max(hi, entry.lo - 1)
+            edge.update((k, c) for k, c in entry.blocks.items()
+                        if k[1] < entry.lo)
+            entry.lo = head
+        if tail > entry.hi:
+            lo = min(lo, entry.hi + 1)
+            edge.update((k, c) for k, c in entry.blocks.items()
+                        if k[1] + (1 << k[0]) - 1 > entry.hi)
+            entry.hi = tail
+        held = dict((k, c) for k, c in entry.blocks.items()
+                    if k[1] <= hi and k[1] + (1 << k[0]) > lo)
+        held.update(edge)
+        stored = dict(((lvl, bid), ctd) for lvl, bid, ctd
+                      in self.storage.blocks(sid, rid, lo, hi))
+        # edge blocks are read again over their full span, whether they are
+        # still stored or not
+        changed = set(held.items()) ^ set(stored.items())
+        spans = sorted(
+            (max(bid, entry.lo), min(bid + (1 << lvl) - 1, entry.hi))
+            for (lvl, bid), ctd in changed | set(edge.items()))
+        if not spans and not fresh:
+            cache.count(hits=1)
+            self.metrics.count("series.hit")
+        merged = []
+        for span in spans:
+            if merged and span[0] <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], span[1]))
+            else:
+                merged.append(span)
+        return entry, merged, held, stored
+
+    def _series_splice(self, key, entry, merged, held, stored, ranges):
+        """Splice the arrays read for the spans of a plan into its entry"""
+        with self.metrics.timer("series.patch"):
+            for (shead, stail), arrays in zip(merged, ranges):
+                arrays = [_truncate(t, v, shead, stail) for t, v in arrays]
+                if arrays:
+                    st, sv = [np.concatenate(a) for a in zip(*arrays)]
+                else:
+                    st, sv = np.empty(0, dtype=np.int64), np.empty(0)
+                entry.splice(shead, stail, st, sv)
+        for k in held:
+            del entry.blocks[k]
+        entry.blocks.update(stored)
+        self.series_cache.count(patches=len(merged))
+        self.metrics.count("series.patch", len(merged))
+        self.series_cache.put(key, entry)
+
+    def _arrays2series(self, sid, arrays, head, tail, datetime):
+        if len(arrays) > 0:
+            with self.metrics.timer("series.concat"):
+                t, v = self._concat(arrays, head, tail, np.int64, np.float64)
+            ts = pd.Series(v, index=t, name=sid)
+            if datetime is True:
+                ts.index = pd.to_datetime(ts.index, unit="s", utc=True)
+            return ts
+        else:
+            return pd.Series([], name=sid)
+
+    def _concat(self, arrays, head, tail, epoch_dtype, value_dtype):
+        """Truncate and join (timestamps, values) arrays into arrays of the
+        given types, allocated once"""
+        epoch_dtype = np.dtype(epoch_dtype)
+        value_dtype = np.dtype(value_dtype)
+        if (epoch_dtype.kind not in "iu" or
+                epoch_dtype.itemsize * 8 - (epoch_dtype.kind == "i") < 31):
+            raise ValueError("Epoch dtype not supported. " +
+                             "Use an integer type of 32 bits or more.")
+        if value_dtype.kind not in "iuf":
+            raise ValueError("Value dtype not supported. " +
+                             "Use a float or integer type.")
+        arrays = [_truncate(t, v, head, tail) for t, v in arrays]
+        n = sum(len(t) for t, v in arrays)
+        t_out = np.empty(n, dtype=epoch_dtype)
+        v_out = np.empty(n, dtype=value_dtype)
+        i = 0
+        for t, v in arrays:
+            j = i + len(t)
+            t_out[i:j] = t
+            with np.errstate(invalid="ignore"):
+                v_out[i:j] = v
+            if value_dtype.kind != "f" and not np.array_equal(v_out[i:j], v):
+                raise ValueError("Values do not fit %s. Use a float type." %
+                                 value_dtype)
+            i = j
+        return t_out, v_out
+
+    def _align(self, sids, sarrays, head, tail, freq, fill):
+        """Map the blocks of each sensor onto a common epoch aligned grid"""
+        if not isinstance(freq, (int, np.integer)):
+            freq = pd.Timedelta(freq).total_seconds()
+        if freq < 1 or freq != int(freq):
+            raise ValueError("Frequency not supported. " +
+                             "Use a whole number of seconds.")
+        freq = int(freq)
+        if fill not in ("ffill", "bfill", "nearest", "linear", None):
+            raise NotImplementedError("Fill method not supported. Use " +
+                                      "'ffill', 'bfill', 'nearest', " +
+                                      "'linear' or None.")
+        columns = []
+        for arrays in sarrays:
+            arrays = [_truncate(t, v, head, tail) for t, v in arrays]
+            if arrays:
+                columns.append([np.concatenate(a) for a in zip(*arrays)])
+            else:
+                columns.append([np.empty(0, dtype=np.int64), np.empty(0)])
+        ts = [t for t, v in columns if len(t) > 0]
+        if ts:
+            head = max(head, min(t[0] for t in ts))
+            tail = min(tail, max(t[-1] for t in ts))
+        else:
+            head, tail = 1, 0
+        grid = np.arange(-(-head // freq) * freq, tail + 1, freq)
+        data = collections.OrderedDict()
+        for sid, (t, v) in zip(sids, columns):
+            data[sid] = self._grid(t, v, grid, fill)
+        return pd.DataFrame(data, index=grid, columns=list(sids))
+
+    def _grid(self, t, v, grid, fill):
+        """Values of a sensor at the grid points"""
+        out = np.full(len(grid), np.nan)
+        if len(t) == 0:
+            return out
+        if fill == "linear":
+            return np.interp(grid, t, v, left=np.nan, right=np.nan)
+        right = np.searchsorted(t, grid, side="left")
+        left = np.searchsorted(t, grid, side="right") - 1
+        if fill == "ffill":
+            idx = left
+        elif fill == "bfill":
+            idx = np.where(right < len(t), right, -1)
+        elif fill == "nearest":
+            nearer = (right < len(t)) & ((left < 0) | (
+                t[np.minimum(right, len(t) - 1)] - grid < grid - t[left]))
+            idx = np.where(nearer, right, left)
+        else:  # exact matches only
+            idx = np.where(left >= 0, left, -1)
+            idx[t[idx] != grid] = -1
+        valid = idx >= 0
+        out[valid] = v[idx[valid]]
+        return out
+
+    def _2timestamp(self, epoch):
+        return pd.Timestamp(epoch, unit="s", tz="UTC")
 
     def _2epochs(self, time):
         if isinstance(time, pd.Timestamp):
@@ -499,37 +2933,45 @@ class Session():
             raise NotImplementedError("Time format not supported. " +
                                       "Use epochs or a Pandas timestamp.")
 
-    def _blk2series(self, ext, blk, head, tail):
-        jblk = self._decompress_block(blk, ext)
-        m = re.match(RE_JSON_BLK, jblk.decode("utf-8"))
-        pdjblk = '{"index":%s,"data":%s}' % (m.group("t"), m.group("v"))
-        try:
-            pdsblk = pd.read_json(
-                pdjblk,
-                typ="series",
-                dtype="float",
-                orient="split",
-                numpy=True,
-                date_unit="s")
-        except:
-            return pd.Series()
-        h = json.loads(m.group("h"))
-        self._npdelta(pdsblk.index, h["head"][0])
-        self._npdelta(pdsblk, h["head"][1])
-        pdsblk_truncated = pdsblk.loc[head:tail]
-        return pdsblk_truncated
-
-    def _npdelta(self, a, delta):
-        """Numpy: Modifying Array Values
-            http://docs.scipy.org/doc/numpy/reference/arrays.nditer.html"""
-        for x in np.nditer(a, op_flags=["readwrite"]):
-            delta += x
-            x[...] = delta
-        return a
-
-    def _req_sync(self, sid, rid, lvl, bid):
+    def _decode(self, rows):
+        """Decode (sid, rid, lvl, bid, ext, created, data) rows into a list
+        of (timestamps, values) arrays, in order, going through the block
+        cache and the decoder executor if there is one"""
+        arrays = [self.cache.get((sid, rid, lvl, bid, ctd))
+                  for sid, rid, lvl, bid, ext, ctd, blk in rows]
+        missing = [i for i, a in enumerate(arrays) if a is None]
+        self.metrics.count("cache.hit", len(rows) - len(missing))
+        self.metrics.count("cache.miss", len(missing))
+        exts = [rows[i][4] for i in missing]
+        blks = [rows[i][6] for i in missing]
+        if self.decoder is None or len(missing) < 2:
+            decoded = []
+            for ext, blk in zip(exts, blks):
+                if ext == BIN_EXT:
+                    with self.metrics.timer("decode.bin"):
+                        decoded.append(_bin2arrays(blk))
+                    continue
+                with self.metrics.timer("decode.decompress"):
+                    jblk = _decompress_block(blk, ext)
+                with self.metrics.timer("decode.parse"):
+                    decoded.append(_jblk2arrays(jblk))
+        else:
+            with self.metrics.timer("decode.pool"):
+                decoded = list(self.decoder.map(_blk2arrays, exts, blks))
+        for i, a in zip(missing, decoded):
+            for x in a:
+                x.flags.writeable = False
+            sid, rid, lvl, bid, ext, ctd, blk = rows[i]
+            self.cache.put((sid, rid, lvl, bid, ctd), a)
+            arrays[i] = a
+        return arrays
+
+    def _token(self, sid):
         self.dbcur.execute(SQL_SENSOR_TOKEN, (sid,))
         token, = self.dbcur.fetchone()
+        return token
+
+    def _req_sync(self, sid, token, rid, lvl, bid):
         headers = {
             "Accept": HTTP_ACCEPT["json"],
             "X-Token": token}
@@ -541,16 +2983,9 @@ class Session():
             API_TMPO_SYNC % (self.host, sid),
             headers=headers,
             params=params,
-            verify=self.crt)
-        r = f.result()
-        r.raise_for_status()
-        fs = []
-        for t in r.json():
-            fs.append((t, self._req_block(
-                sid, token, t["rid"], t["lvl"], t["bid"], t["ext"])))
-        for (t, f) in fs:
-            self._write_block(
-                f.result(), sid, t["rid"], t["lvl"], t["bid"], t["ext"])
+            verify=self.crt,
+            timeout=HTTP_TIMEOUT)
+        return f
 
     def _req_block(self, sid, token, rid, lvl, bid, ext):
         headers = {
@@ -559,31 +2994,122 @@ class Session():
         f = self.rqs.get(
             API_TMPO_BLOCK % (self.host, sid, rid, lvl, bid),
             headers=headers,
-            verify=self.crt)
+            verify=self.crt,
+            timeout=HTTP_TIMEOUT)
         self._dprintf(DBG_TMPO_REQUEST, time.time(), sid, rid, lvl, bid)
         return f
 
     def _write_block(self, r, sid, rid, lvl, bid, ext):
-        blk = sqlite3.Binary(r.content)
+        self._store([self._block_row(r.content, sid, rid, lvl, bid, ext)])
+
+    @transactional
+    def _store(self, rows, arrays=None):
+        self._write_blocks(rows, arrays)
+
+    def _block_row(self, content, sid, rid, lvl, bid, ext, now=None):
+        blk = sqlite3.Binary(content)
+        if now is None:
+            now = time.time()
+        return (sid, rid, lvl, bid, ext, now, blk)
+
+    def _block_rows(self, sid, tlist, contents):
+        """Encoded rows and decoded arrays for the blocks of a sync listing,
+        up to the first block that fails to decode, and that error or None.
+        Creation times strictly increase in listing order, so SQL_TMPO_LAST
+        finds the last listed block regardless of download order."""
         now = time.time()
-        self.dbcur.execute(SQL_TMPO_INS, (sid, rid, lvl, bid, ext, now, blk))
-        self._clean(sid, rid, lvl, bid)
-        self._dprintf(DBG_TMPO_WRITE, now, sid, rid, lvl, bid, len(blk))
-
-    def _clean(self, sid, rid, lvl, bid):
-        if lvl == 8:
-            return
-        lastchild = self._lastchild(lvl, bid)
-        self.dbcur.execute(SQL_TMPO_CLEAN, (sid, rid, lvl - 4, lastchild))
-        self._clean(sid, rid, lvl - 4, lastchild)
+        rows, arrays = [], []
+        for i, (t, content) in enumerate(zip(tlist, contents)):
+            row = self._block_row(content, sid, t["rid"], t["lvl"], t["bid"],
+                                  t["ext"], now + i * 1e-6)
+            try:
+                with self.metrics.timer("db.encode"):
+                    (row,), (a,) = self._encode([row])
+            except Exception as e:  # corrupt or unsupported block
+                return rows, arrays, e
+            rows.append(row)
+            arrays.append(a)
+        return rows, arrays, None
+
+    def _write_blocks(self, rows, arrays=None):
+        """Insert tmpo block rows in batches and clean the blocks each batch
+        supersedes. Rows are encoded first unless their decoded arrays are
+        given."""
+        for i in range(0, len(rows), WRITE_BATCH):
+            batch = rows[i:i + WRITE_BATCH]
+            if arrays is None:
+                with self.metrics.timer("db.encode"):
+                    batch, barrays = self._encode(batch)
+            else:
+                barrays = arrays[i:i + WRITE_BATCH]
+            with self.metrics.timer("db.write"):
+                self.storage.put(batch, barrays)
+            with self.metrics.timer("db.rollup"):
+                self._write_rollups(batch, barrays)
+            for sid, rid, lvl, bid, ext, now, blk in batch:
+                self.cache.invalidate(sid)
+                self._dprintf(DBG_TMPO_WRITE, now, sid, rid, lvl, bid,
+                              len(blk))
+            with self.metrics.timer("db.clean"):
+                self._clean(*[row[:4] for row in batch])
+
+    def _encode(self, rows):
+        """Decode (sid, rid, lvl, bid, ext, created, data) rows, transcoding
+        gzip json blocks to the codec of the session on the way"""
+        encoded, arrays = [], []
+        for sid, rid, lvl, bid, ext, ctd, blk in rows:
+            if ext == "gz" and self.codec == BIN_EXT:
+                ext = BIN_EXT
+                blk, a = _gz2bin(blk)
+            else:
+                a = _blk2arrays(ext, blk)
+            encoded.append((sid, rid, lvl, bid, ext, ctd, blk))
+            arrays.append(a)
+        return encoded, arrays
+
+    def _header(self, t, v):
+        """(head_t, head_v, tail_t, tail_v) of a decoded block"""
+        if len(t) == 0:
+            return (None, None, None, None)
+        return (int(t[0]), float(v[0]), int(t[-1]), float(v[-1]))
+
+    def _write_rollups(self, rows, arrays=None):
+        """Store per block aggregates of (sid, rid, lvl, bid, ext, created,
+        data) rows at each of the ROLLUP_RES resolutions"""
+        if arrays is None:
+            arrays = [_blk2arrays(row[4], row[6]) for row in rows]
+        rollups = []
+        for (sid, rid, lvl, bid, ext, ctd, blk), (t, v) in zip(rows, arrays):
+            for res in ROLLUP_RES:
+                for r in zip(*_rollup(t, v, res)):
+                    rollups.append((sid, rid, lvl, bid, res, int(r[0]),
+                                    int(r[1])) + tuple(map(float, r[2:])))
+        self.dbcur.executemany(SQL_ROLLUP_INS, rollups)
+
+    def _clean(self, *blocks):
+        """Delete the descendants of the given (sid, rid, lvl, bid) blocks,
+        with one DELETE per sensor, recycle id and level"""
+        cleans = {}
+        for sid, rid, lvl, bid in blocks:
+            while lvl > 8:
+                bid = self._lastchild(lvl, bid)
+                lvl -= 4
+                key = (sid, rid, lvl)
+                cleans[key] = max(bid, cleans.get(key, bid))
+        cleans = [key + (bid,) for key, bid in cleans.items()]
+        self.storage.clean(cleans)
+        self.dbcur.executemany(SQL_ROLLUP_CLEAN, cleans)
+        for sid in set(clean[0] for clean in cleans):
+            self.cache.invalidate(sid)
 
     def _lastchild(self, lvl, bid):
         delta = math.trunc(2 ** (lvl - 4))
         return bid + 15 * delta
 
-    def _blocktail(self, lvl, bid):
+    def _blockhead(self, lvl, head):
+        """Lower bound on the bid of a block of level lvl ending after head"""
         delta = math.trunc(2 ** lvl)
-        return bid + delta
+        return head - delta
 
     def _dprintf(self, fmt, *args):
         if self.debug:
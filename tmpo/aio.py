@@ -0,0 +1,341 @@
+"""
+asyncio interface to tmpo, requires Python 3 and aiohttp
+
+    >>> import tmpo.aio
+    >>> async with tmpo.aio.AsyncSession() as s:
+    ...     await s.sync()
+    ...     ts = await s.series("fed676021dacaaf6a12a8dda7685be34")
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import itertools
+import ssl
+import time
+
+import aiohttp
+
+from . import (Session, CACHE_SIZE, EPOCHS_MAX, WRITE_BATCH, API_TMPO_SYNC,
+               API_TMPO_BLOCK, HTTP_ACCEPT, HTTP_TIMEOUT, HTTP_RETRIES,
+               DBG_TMPO_REQUEST, _backoff)
+
+
+def _retryable(e):
+    """Whether a failed request is worth retrying: connection problems,
+    timeouts, throttling and server errors"""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+class AsyncSession():
+    def __init__(self, path=None, workers=16, cache_size=CACHE_SIZE,
+                 inflight=None, metrics=None, storage="sqlite",
+                 codec="bin", series_cache=0):
+        """
+        Mirrors Session. HTTP requests share one non-blocking connection pool,
+        while SQLite access and block decoding run on a worker thread so they
+        never block the event loop.
+
+        Parameters
+        ----------
+        path : str, optional
+            location for the database
+        workers : int
+            sets inflight when it is not given
+            default 16
+        cache_size : int
+            byte budget of the decoded block cache, 0 disables it
+            default 64 MiB
+        inflight : int, optional
+            maximum number of outstanding requests during sync
+            default 4 * workers
+        metrics : Metrics, optional
+            instrumentation hooks, e.g. a MemoryMetrics collector
+            default no-op
+        storage : str | type, optional
+            block storage backend, see Session
+            default "sqlite"
+        codec : str, optional
+            encoding of stored blocks, see Session
+            default "bin"
+        series_cache : int
+            byte budget of the series cache, see Session
+            default 0
+        """
+        self.session = Session(path, workers=workers, cache_size=cache_size,
+                               inflight=inflight, metrics=metrics,
+                               storage=storage, codec=codec,
+                               series_cache=series_cache)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._http = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Close the connection pool, the database worker and the session"""
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+        await self._run(self.session.close)
+        self.executor.shutdown(wait=False)
+
+    async def add(self, sid, token):
+        """
+        Add new sensor to the database
+
+        Parameters
+        ----------
+        sid : str
+            SensorId
+        token : str
+        """
+        await self._run(self.session.add, sid, token)
+
+    async def remove(self, sid):
+        """
+        Remove sensor from the database
+
+        Parameters
+        ----------
+        sid : str
+            SensorID
+        """
+        await self._run(self.session.remove, sid)
+
+    async def reset(self, sid):
+        """
+        Removes all tmpo blocks for a given sensor, but keeps sensor table
+        intact, so sensor id and token remain in the database.
+
+        Parameters
+        ----------
+        sid : str
+        """
+        await self._run(self.session.reset, sid)
+
+    async def sync(self, *sids, limiter=None):
+        """
+        Synchronise data, leasing sensors like Session.sync. Up to
+        inflight sensors are synced at once.
+
+        Parameters
+        ----------
+        sids : list of str
+            SensorIDs to sync
+            Optional, leave empty to sync everything
+        limiter : object, optional
+            rate limit on requests, see Session.sync
+            default None
+
+        Returns
+        -------
+        dict
+            number of blocks written per SensorID, or the exception that
+            interrupted the sync of that sensor
+        """
+        results = {}
+        start = time.time()
+        if sids == ():
+            sids = await self._run(self.session._sensors)
+        sids = collections.deque(sids)
+        heads = collections.deque()
+        rows, arrays = [], []
+        leased = set()
+        done = []  # sensors to release once their rows are written
+        lock = asyncio.Lock()
+
+        async def lease():
+            """Next (sid, token, rid, lvl, bid) to sync, leasing SYNC_BATCH
+            more sensors when the leased ones are taken"""
+            async with lock:
+                while not heads and sids:
+                    chunk = await self._run(
+                        self.session._lease, sids, start)
+                    leased.update(chunk)
+                    sheads = await self._run(
+                        self.session._sync_heads, chunk, results)
+                    heads.extend(sheads)
+                    polled = set(head[0] for head in sheads)
+                    done.extend(sid for sid in chunk if sid not in polled)
+                return heads.popleft() if heads else None
+
+        async def write(force=False):
+            if rows and (force or len(rows) >= WRITE_BATCH):
+                batch, barrays = rows[:], arrays[:]
+                del rows[:], arrays[:]
+                released = done[:]
+                del done[:]
+                await self._run(self.session._store, batch, barrays)
+            elif done and not rows:
+                released = done[:]
+                del done[:]
+            else:
+                return
+            await self._run(self.session._release, released, results)
+            leased.difference_update(released)
+
+        async def sync_sensor(sid, token, rid, lvl, bid):
+            tlist, contents = [], []
+            try:
+                tlist = await self._retry(
+                    limiter, self._req_sync, sid, token, rid, lvl, bid)
+                contents = await asyncio.gather(*[
+                    self._retry(limiter, self._req_block, sid, token,
+                                t["rid"], t["lvl"], t["bid"])
+                    for t in tlist], return_exceptions=True)
+                for i, content in enumerate(contents):
+                    if isinstance(content, BaseException):
+                        # keep what was downloaded before the failed block
+                        tlist, contents = tlist[:i], contents[:i]
+                        raise content
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    ValueError) as e:
+                results[sid] = e
+            await self._run(self.session._renew)
+            brows, barrays, e = await self._run(
+                self.session._block_rows, sid, tlist, contents)
+            if not isinstance(results.get(sid), Exception):
+                results[sid] = len(brows) if e is None else e
+            rows.extend(brows)
+            arrays.extend(barrays)
+            done.append(sid)
+
+        async def worker():
+            while True:
+                head = await lease()
+                if head is None:
+                    return
+                await sync_sensor(*head)
+                await write()
+
+        try:
+            await asyncio.gather(*[
+                worker() for _ in range(self.session.inflight)])
+            await write(force=True)
+        finally:
+            await self._run(self.session._release, list(leased), results)
+        return results
+
+    async def series(self, sid, recycle_id=None, head=None, tail=None,
+                     datetime=True):
+        """
+        Create data Series, see Session.series
+
+        Returns
+        -------
+        pandas.Series
+        """
+        return await self._run(
+            self.session.series, sid, recycle_id=recycle_id, head=head,
+            tail=tail, datetime=datetime)
+
+    async def dataframe(self, sids, head=0, tail=EPOCHS_MAX, datetime=True,
+                        freq=None, fill="ffill"):
+        """
+        Create data frame, see Session.dataframe
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        return await self._run(
+            self.session.dataframe, sids, head=head, tail=tail,
+            datetime=datetime, freq=freq, fill=fill)
+
+    async def array(self, sid, recycle_id=None, head=None, tail=None,
+                    epoch_dtype="int64", value_dtype="float64"):
+        """
+        Data as plain NumPy arrays, see Session.array
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+        """
+        return await self._run(
+            self.session.array, sid, recycle_id=recycle_id, head=head,
+            tail=tail, epoch_dtype=epoch_dtype, value_dtype=value_dtype)
+
+    async def arrays(self, sids, head=0, tail=EPOCHS_MAX,
+                     epoch_dtype="int64", value_dtype="float64"):
+        """
+        Data of several sensors as plain NumPy arrays, see Session.arrays
+
+        Returns
+        -------
+        collections.OrderedDict
+        """
+        return await self._run(
+            self.session.arrays, sids, head=head, tail=tail,
+            epoch_dtype=epoch_dtype, value_dtype=value_dtype)
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _retry(self, limiter, request, *args):
+        """Retry a failed request up to HTTP_RETRIES times, with jittered
+        exponential backoff, each attempt waiting for the limiter"""
+        for attempt in itertools.count():
+            while limiter is not None:
+                delay = limiter.acquire()
+                if not delay:
+                    break
+                await asyncio.sleep(delay)
+            try:
+                return await request(*args)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= HTTP_RETRIES or not _retryable(e):
+                    raise
+                self.session.metrics.count("http.retry")
+                await asyncio.sleep(_backoff(attempt))
+
+    def _http_session(self):
+        if self._http is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.session.inflight,
+                ssl=ssl.create_default_context(cafile=self.session.crt))
+            timeout = aiohttp.ClientTimeout(
+                total=None, sock_connect=HTTP_TIMEOUT, sock_read=HTTP_TIMEOUT)
+            self._http = aiohttp.ClientSession(
+                connector=connector, timeout=timeout,
+                headers={"X-Version": "1.0"})
+        return self._http
+
+    async def _req_sync(self, sid, token, rid, lvl, bid):
+        headers = {
+            "Accept": HTTP_ACCEPT["json"],
+            "X-Token": token}
+        params = {
+            "rid": rid,
+            "lvl": lvl,
+            "bid": bid}
+        with self.session.metrics.timer("http.sync"):
+            async with self._http_session().get(
+                    API_TMPO_SYNC % (self.session.host, sid),
+                    headers=headers,
+                    params=params) as r:
+                r.raise_for_status()
+                return await r.json(content_type=None)
+
+    async def _req_block(self, sid, token, rid, lvl, bid):
+        headers = {
+            "Accept": HTTP_ACCEPT["gz"],
+            "X-Token": token}
+        self.session._dprintf(
+            DBG_TMPO_REQUEST, time.time(), sid, rid, lvl, bid)
+        with self.session.metrics.timer("http.block"):
+            async with self._http_session().get(
+                    API_TMPO_BLOCK % (self.session.host, sid, rid, lvl, bid),
+                    headers=headers) as r:
+                r.raise_for_status()
+                content = await r.read()
+        self.session.metrics.count("http.bytes", len(content))
+        return content
@@ -0,0 +1,316 @@
+"""
+Long running sync of a tmpo database, and the tmpo command line
+
+    $ tmpo add fed676021dacaaf6a12a8dda7685be34 b371402dc767cc83e41bc294b63f9586
+    $ tmpo daemon --rate 20
+
+    >>> import tmpo.daemon
+    >>> d = tmpo.daemon.SyncDaemon(tmpo.Session(), rate=20)
+    >>> d.run()
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import random
+import signal
+import sys
+import threading
+import time
+
+from . import Session, SQL_SENSOR_ALL, SQL_SYNC_POS, SQL_TMPO_LAST_DATA_ALL
+
+DAEMON_RATE = 20.0  # requests per second
+DAEMON_BURST = 10.0  # seconds of requests
+DAEMON_JITTER = 60.0  # seconds
+DAEMON_BACKOFF = 256  # seconds, doubled on every sync without progress
+DAEMON_BACKOFF_MAX = 6 * 3600  # seconds
+DAEMON_REFRESH = 300  # seconds between reloads of the sensor list
+DAEMON_STATS = 60  # seconds between stats log lines
+DAEMON_BATCH = 256  # sensors per sync
+
+log = logging.getLogger("tmpo")
+
+
+def _due(lvl, bid):
+    """Epoch at which a sensor whose last block is (lvl, bid) has a new
+    complete lvl 8 block to fetch. The last lvl 8 block is the one still
+    being filled, higher levels are followed by a first lvl 8 block."""
+    if lvl is None:
+        return 0
+    tail = bid + (1 << lvl)
+    return tail if lvl <= 8 else tail + 256
+
+
+class _Budget():
+    def __init__(self, rate, burst):
+        """Token bucket of rate requests per second, holding at most burst
+        seconds worth. Passed to Session.sync as its limiter, so every
+        request, retries included, takes a token."""
+        self.rate = rate
+        self.size = max(1.0, rate * burst)
+        self.tokens = self.size
+        self.taken = 0
+        self._last = time.time()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.size,
+                          self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def wait(self):
+        """Seconds until a request can be afforded"""
+        self.refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        """Take a token, returning 0, or else the seconds until there is
+        one"""
+        delay = self.wait()
+        if delay == 0:
+            self.tokens -= 1
+            self.taken += 1
+        return delay
+
+
+class SyncDaemon():
+    def __init__(self, session, rate=DAEMON_RATE, jitter=DAEMON_JITTER,
+                 batch=DAEMON_BATCH, stats_interval=DAEMON_STATS):
+        """
+        Keeps the sensors of a session fresh. Sensors wait in a priority
+        queue ordered by when their next lvl 8 block completes, derived from
+        the last stored (lvl, bid), and are synced in batches once due. Due
+        times are spread by a random jitter so sensors sharing a block
+        boundary are not all polled at once, and every request of the syncs
+        draws from one budget. Sensors that fail or bring no new blocks back
+        off exponentially, up to DAEMON_BACKOFF_MAX.
+
+        Several daemons, or other sessions, can share a database, sensors are
+        leased as with Session.sync.
+
+        Parameters
+        ----------
+        session : Session
+        rate : float
+            budget of API requests per second, averaged over DAEMON_BURST
+            seconds
+            default 20
+        jitter : float
+            maximum random delay added to due times in seconds
+            default 60
+        batch : int
+            maximum number of sensors per sync
+            default 256
+        stats_interval : float
+            seconds between logged stats, 0 disables them
+            default 60
+        """
+        self.session = session
+        self.jitter = jitter
+        self.batch = batch
+        self.stats_interval = stats_interval
+        self.budget = _Budget(rate, DAEMON_BURST)
+        self.syncs = 0
+        self.blocks = 0
+        self.errors = 0
+        self.started = time.time()
+        self._sensors = {}  # sid -> [due, syncs without progress]
+        self._queue = []  # heap of (due, seq, sid)
+        self._seq = itertools.count()
+        self._refreshed = 0
+        self._logged = time.time()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Sync until stop() is called"""
+        self._stop.clear()
+        while not self._stop.is_set():
+            self._stop.wait(self.step())
+
+    def stop(self):
+        self._stop.set()
+
+    def step(self):
+        """
+        Sync the sensors that are due, as far as the budget allows
+
+        Returns
+        -------
+        float
+            seconds until the next sensor is due or affordable
+        """
+        now = time.time()
+        if now >= self._refreshed + DAEMON_REFRESH:
+            self.refresh()
+        if self.stats_interval and now >= self._logged + self.stats_interval:
+            self._log()
+        sids = []
+        if self.budget.wait() == 0:
+            while (self._queue and self._queue[0][0] <= now and
+                   len(sids) < self.batch):
+                due, seq, sid = heapq.heappop(self._queue)
+                if self._sensors.get(sid, (None,))[0] != due:
+                    continue  # removed or rescheduled
+                sids.append(sid)
+        if sids:
+            self._sync(sids)
+        if not self._queue:
+            return DAEMON_REFRESH
+        if self._queue[0][0] <= time.time():
+            return self.budget.wait()
+        return min(self._queue[0][0] - time.time(), DAEMON_REFRESH)
+
+    def refresh(self):
+        """Reload the sensor list, scheduling sensors added since and
+        dropping removed ones"""
+        cur = self.session.dbcur
+        sids = set(sid for (sid,) in cur.execute(SQL_SENSOR_ALL))
+        pos = dict((sid, (lvl, bid)) for sid, lvl, bid
+                   in cur.execute(SQL_SYNC_POS))
+        for sid in list(self._sensors):
+            if sid not in sids:
+                del self._sensors[sid]
+        for sid in sids - set(self._sensors):
+            self._sensors[sid] = [None, 0]
+            self._schedule(sid, _due(*pos.get(sid, (None, None))))
+        self._refreshed = time.time()
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+            sensors: number of sensors scheduled
+            queue: number of sensors due
+            backoff: number of sensors backing off
+            lag: seconds since the last stored sample, per SensorID
+            syncs, blocks, requests, errors: totals since the start
+            blocks_per_s, requests_per_s: averages since the start
+        """
+        now = time.time()
+        uptime = max(now - self.started, 1e-9)
+        tails = dict((sid, tail) for sid, tail, value
+                     in self.session.dbcur.execute(SQL_TMPO_LAST_DATA_ALL))
+        return {
+            "sensors": len(self._sensors),
+            "queue": sum(1 for due, misses in self._sensors.values()
+                         if due <= now),
+            "backoff": sum(1 for due, misses in self._sensors.values()
+                           if misses > 0),
+            "lag": dict((sid, now - tails[sid]) if sid in tails
+                        else (sid, None) for sid in self._sensors),
+            "syncs": self.syncs,
+            "blocks": self.blocks,
+            "requests": self.budget.taken,
+            "errors": self.errors,
+            "uptime": uptime,
+            "blocks_per_s": self.blocks / uptime,
+            "requests_per_s": self.budget.taken / uptime}
+
+    def _sync(self, sids):
+        results = self.session.sync(*sids, limiter=self.budget)
+        pos = dict((sid, (lvl, bid)) for sid, lvl, bid
+                   in self.session.dbcur.execute(SQL_SYNC_POS))
+        now = time.time()
+        for sid in sids:
+            if sid not in self._sensors:
+                continue  # removed meanwhile
+            state = self._sensors[sid]
+            due = _due(*pos.get(sid, (None, None)))
+            result = results.get(sid)
+            if result is None:
+                # leased by another session, which keeps it fresh
+                due = max(due, now + DAEMON_BACKOFF)
+            elif isinstance(result, Exception) or result == 0:
+                if isinstance(result, Exception):
+                    self.errors += 1
+                    log.warning("sync %s failed: %s", sid, result)
+                state[1] += 1
+                due = max(due, now + min(
+                    DAEMON_BACKOFF * 2 ** (state[1] - 1), DAEMON_BACKOFF_MAX))
+            else:
+                state[1] = 0
+                self.blocks += result
+            if result is not None:
+                self.syncs += 1
+            self._schedule(sid, max(due, now))
+
+    def _schedule(self, sid, due):
+        due += random.uniform(0, self.jitter)
+        self._sensors[sid][0] = due
+        heapq.heappush(self._queue, (due, next(self._seq), sid))
+
+    def _log(self):
+        stats = self.stats()
+        lags = [lag for lag in stats.pop("lag").values() if lag is not None]
+        stats["lag_max"] = max(lags) if lags else None
+        log.info("stats %s", json.dumps(stats, sort_keys=True))
+        self._logged = time.time()
+
+
+def main(argv=None):
+    """Entry point of the tmpo command"""
+    parser = argparse.ArgumentParser(
+        prog="tmpo", description="Sync Flukso sensor data with tmpo")
+    parser.add_argument("--path", help="location for the database")
+    parser.add_argument("--workers", type=int, default=16,
+                        help="Session workers: outstanding requests a "
+                        "sync starts with, adapting up to 4 times as many")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    add = commands.add_parser("add", help="add a sensor")
+    add.add_argument("sid")
+    add.add_argument("token")
+    remove = commands.add_parser("remove", help="remove a sensor")
+    remove.add_argument("sid")
+    sync = commands.add_parser("sync", help="sync once")
+    sync.add_argument("sids", nargs="*")
+    transcode = commands.add_parser(
+        "transcode", help="convert stored blocks to the binary codec")
+    transcode.add_argument("sids", nargs="*")
+    daemon = commands.add_parser("daemon", help="keep all sensors synced")
+    daemon.add_argument("--rate", type=float, default=DAEMON_RATE,
+                        help="API requests per second")
+    daemon.add_argument("--jitter", type=float, default=DAEMON_JITTER,
+                        help="maximum random delay of a sync in seconds")
+    daemon.add_argument("--batch", type=int, default=DAEMON_BATCH,
+                        help="maximum number of sensors per sync")
+    daemon.add_argument("--stats-interval", type=float, default=DAEMON_STATS,
+                        help="seconds between stats log lines, 0 disables")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    session = Session(args.path, workers=args.workers)
+    try:
+        if args.command == "add":
+            session.add(args.sid, args.token)
+        elif args.command == "remove":
+            session.remove(args.sid)
+        elif args.command == "sync":
+            results = session.sync(*args.sids)
+            print(json.dumps(dict(
+                (sid, r if isinstance(r, int) else str(r))
+                for sid, r in results.items()), indent=2, sort_keys=True))
+        elif args.command == "transcode":
+            print(json.dumps(session.transcode(*args.sids), indent=2,
+                             sort_keys=True))
+        elif args.command == "daemon":
+            d = SyncDaemon(session, rate=args.rate, jitter=args.jitter,
+                           batch=args.batch,
+                           stats_interval=args.stats_interval)
+            signal.signal(signal.SIGTERM, lambda signum, frame: d.stop())
+            try:
+                d.run()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())